@@ -0,0 +1,133 @@
+"""
+Arrow-backed DataFrames between the pipeline stages.
+
+With copy-on-write on & Arrow-backed dtypes, the Tidy #1 column selection
+(rt_tweets.loc[:, tweet_cols]) and the Q7 rename only create new metadata
+pointing at the same buffers, and string columns (text, expanded_urls,
+jpg_url, ...) are Arrow strings instead of one Python object per row.
+
+profile_stage() measures how many columns a stage really copied and its
+peak memory, so the effect can be checked per stage.
+
+Needs pandas >= 2.0 & pyarrow.
+"""
+from contextlib import contextmanager
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - only the copy counting works without it
+    pa = None
+
+
+def copy_on_write(enable=True):
+    """Turn pandas copy-on-write on (always on from pandas 3.0)."""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    pd.set_option('mode.copy_on_write', enable)
+    return enable
+
+
+@contextmanager
+def copy_on_write_scope(enable=True):
+    """copy_on_write() inside a with block only, the previous setting comes back after it."""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        yield
+        return
+    with pd.option_context('mode.copy_on_write', enable):
+        yield
+
+
+def read_csv(path, **kwargs):
+    """pd.read_csv parsed by pyarrow, straight into Arrow-backed columns."""
+    return pd.read_csv(path, engine='pyarrow', dtype_backend='pyarrow', **kwargs)
+
+
+def to_arrow(df):
+    """
+    Arrow-backed copy of df. Columns of nested objects (user, entities, ...)
+    stay object dtype, pyarrow can't hold mixed dicts without a schema.
+    """
+    return df.convert_dtypes(dtype_backend='pyarrow')
+
+
+def to_table(df):
+    """pyarrow Table of df, zero copy for Arrow-backed columns."""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def from_table(table):
+    """DataFrame of Arrow-backed columns over the table's buffers."""
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def buffers(series):
+    """Addresses of the memory buffers behind a column."""
+    array = series.array
+    chunked = getattr(array, '_pa_array', None)
+    if chunked is not None:
+        return {buf.address for chunk in chunked.chunks for buf in chunk.buffers() if buf is not None}
+    values = np.asarray(array)
+    return {values.__array_interface__['data'][0]} if values.size else set()
+
+
+def copied_columns(before, after):
+    """Columns of after (matched by position) whose data is not shared with before."""
+    copied = []
+    for i, name in enumerate(after.columns):
+        src = before.columns[i] if i < len(before.columns) else None
+        if name in before.columns:
+            src = name
+        if src is None or not buffers(after[name]) & buffers(before[src]):
+            copied.append(name)
+    return copied
+
+
+def profile_stage(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) & measure it.
+
+    Returns (result, stats) with seconds, peak_mb (NumPy & Python allocations),
+    arrow_mb (Arrow memory pool growth) and, when the first argument and the result
+    are DataFrames, copied_columns / n_columns.
+    """
+    pool = pa.default_memory_pool() if pa is not None else None
+    arrow_before = pool.bytes_allocated() if pool is not None else 0
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = timer()
+    result = func(*args, **kwargs)
+    elapsed = timer() - start
+    _, peak = tracemalloc.get_traced_memory()
+    if not tracing:
+        tracemalloc.stop()
+
+    stats = {
+        'seconds': elapsed,
+        'peak_mb': peak / 1e6,
+        'arrow_mb': ((pool.bytes_allocated() if pool is not None else 0) - arrow_before) / 1e6,
+    }
+    if args and isinstance(args[0], pd.DataFrame) and isinstance(result, pd.DataFrame):
+        stats['copied_columns'] = len(copied_columns(args[0], result))
+        stats['n_columns'] = len(result.columns)
+    return result, stats
+
+
+class Profiled(object):
+    """Stage function wrapper that records profile_stage() stats under its name."""
+
+    def __init__(self, name, func, stats):
+        self.name = name
+        self.func = func
+        self.stats = stats
+
+    def __call__(self, *args):
+        result, self.stats[self.name] = profile_stage(self.func, *args)
+        return result
@@ -0,0 +1,60 @@
+"""
+Rank dog breeds by confidence-weighted counts.
+
+groupby('p1').size() counts every first guess, including non-dogs
+('seat_belt', 'web_site', ...) and very unsure ones. Here each tweet counts
+for the best *dog* prediction among p1..p3, weighted by its confidence and
+only if that confidence reaches a threshold. Breeds are dictionary encoded
+and the top k are picked with np.argpartition, so nothing is fully sorted.
+"""
+import numpy as np
+import pandas as pd
+
+PREDS = [('p1', 'p1_conf', 'p1_dog'), ('p2', 'p2_conf', 'p2_dog'), ('p3', 'p3_conf', 'p3_dog')]
+
+
+def best_dog(df):
+    """DataFrame of breed & conf: the first of p1..p3 that is a dog, NaN if none is."""
+    is_dog = [df[dog].fillna(False).astype(bool).values for _, _, dog in PREDS]
+    breed = np.select(is_dog, [df[name].values for name, _, _ in PREDS], default=None)
+    conf = np.select(is_dog, [df[conf].values.astype(float) for _, conf, _ in PREDS], default=np.nan)
+    return pd.DataFrame({'breed': breed, 'conf': conf}, index=df.index)
+
+
+def breed_scores(df, min_conf=0.0, weighted=True):
+    """
+    Score of every breed as arrays (breeds, scores, counts).
+
+    breeds are the dictionary of codes, scores[i] & counts[i] belong to breeds[i].
+    """
+    best = best_dog(df)
+    keep = best.conf.values >= min_conf
+    codes, breeds = pd.factorize(best.breed.values[keep])
+    conf = best.conf.values[keep]
+    # codes are -1 for missing breeds, np.bincount can't take those
+    valid = codes >= 0
+    counts = np.bincount(codes[valid], minlength=len(breeds))
+    scores = np.bincount(codes[valid], weights=conf[valid], minlength=len(breeds)) if weighted else counts.astype(float)
+    return np.asarray(breeds, dtype=object), scores, counts
+
+
+def top_k(scores, k):
+    """Positions of the k largest scores, largest first; only the k winners are sorted."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+def top_breeds(df, k=10, min_conf=0.0, weighted=True):
+    """
+    Top k breeds by confidence-weighted count.
+
+    Returns a DataFrame indexed by breed with 'score' (sum of conf, or count if
+    weighted=False) & 'count' (tweets counted), best first.
+    """
+    breeds, scores, counts = breed_scores(df, min_conf=min_conf, weighted=weighted)
+    best = top_k(scores, k)
+    return pd.DataFrame({'score': scores[best], 'count': counts[best]},
+                        index=pd.Index(breeds[best], name='breed'))
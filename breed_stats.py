@@ -0,0 +1,153 @@
+"""
+Confidence intervals for per-breed counts and means.
+
+All breeds are resampled at once: rows are sorted by breed code, the
+resampled row indices for every breed & every resample are drawn as one
+NumPy array and summed per breed with np.add.reduceat. There are no Python
+loops per breed or per resample (resamples are only chunked to bound memory).
+
+    mean_ci(new_tweets_df2, 'p1', ['favorite_count', 'retweet_count', 'rating'])
+    score_ci(new_tweets_df2, min_conf=0.2)
+"""
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from breed_rank import best_dog
+
+# bounds the (resamples x rows) arrays to ~ 8M values per chunk
+CHUNK_VALUES = 8000000
+
+
+def z_score(ci):
+    """Two-sided normal quantile, 1.96 for ci=0.95."""
+    return NormalDist().inv_cdf(0.5 + ci / 2)
+
+
+def _sorted_groups(codes, values, n_groups):
+    """Sort rows by group, returns sorted values, group sizes & start offsets."""
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    return values[order], sizes, starts
+
+
+def _chunks(n_boot, n_rows):
+    step = max(1, CHUNK_VALUES // max(n_rows, 1))
+    for first in range(0, n_boot, step):
+        yield min(step, n_boot - first)
+
+
+def bootstrap_means(codes, values, n_groups, n_boot=1000, seed=0):
+    """(n_boot, n_groups) array of resampled group means; groups are resampled within themselves."""
+    values, sizes, starts = _sorted_groups(codes, values, n_groups)
+    present = sizes > 0
+    row_start = np.repeat(starts, sizes)
+    row_size = np.repeat(sizes, sizes)
+
+    rng = np.random.default_rng(seed)
+    means = np.full((n_boot, len(sizes)), np.nan)
+    done = 0
+    for n in _chunks(n_boot, len(values)):
+        # each row draws a random row of its own group
+        idx = row_start + (rng.random((n, len(values))) * row_size).astype(np.int64)
+        sums = np.add.reduceat(values[idx], starts[present], axis=1)
+        means[done:done + n, present] = sums / sizes[present]
+        done += n
+    return means
+
+
+def bootstrap_totals(codes, weights, n_groups, n_boot=1000, seed=0):
+    """(n_boot, n_groups) array of resampled group totals (Poisson bootstrap over all rows)."""
+    weights, sizes, starts = _sorted_groups(codes, weights, n_groups)
+    present = sizes > 0
+
+    rng = np.random.default_rng(seed)
+    totals = np.zeros((n_boot, len(sizes)))
+    done = 0
+    for n in _chunks(n_boot, len(weights)):
+        # every row is drawn Poisson(1) times, same as resampling the table with replacement for large n
+        draws = rng.poisson(1.0, size=(n, len(weights)))
+        totals[done:done + n, present] = np.add.reduceat(draws * weights, starts[present], axis=1)
+        done += n
+    return totals
+
+
+def _interval(samples, ci):
+    tail = (1 - ci) / 2 * 100
+    return np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+
+
+def _rating(df):
+    if 'rating' in df.columns:
+        return df['rating']
+    return df['rating_numerator'] / df['rating_denominator']
+
+
+def mean_ci(df, by='p1', cols=('favorite_count', 'retweet_count', 'rating'), ci=0.95,
+            method='bootstrap', n_boot=1000, seed=0):
+    """
+    Mean & confidence interval of each column per group of df[by].
+
+    method - 'bootstrap' (percentile) or 'analytic' (normal approximation)
+    Returns a DataFrame indexed by group with n & <col>, <col>_low, <col>_high columns.
+    """
+    codes, groups = pd.factorize(df[by])
+    result = pd.DataFrame(index=pd.Index(groups, name=by))
+    valid = codes >= 0
+    result['n'] = np.bincount(codes[valid], minlength=len(groups))
+
+    for col in cols:
+        values = (_rating(df) if col == 'rating' else df[col]).values.astype(float)
+        keep = valid & ~np.isnan(values)
+        group_codes, group_values = codes[keep], values[keep]
+        n = np.bincount(group_codes, minlength=len(groups))
+        mean = np.bincount(group_codes, weights=group_values, minlength=len(groups)) / np.where(n, n, np.nan)
+
+        if method == 'bootstrap':
+            low, high = _interval(bootstrap_means(group_codes, group_values, len(groups), n_boot, seed), ci)
+        elif method == 'analytic':
+            sq = np.bincount(group_codes, weights=group_values ** 2, minlength=len(groups))
+            var = (sq - n * mean ** 2) / np.where(n > 1, n - 1, np.nan)
+            half = z_score(ci) * np.sqrt(np.clip(var, 0, None) / n)
+            low, high = mean - half, mean + half
+        else:
+            raise ValueError("method must be 'bootstrap' or 'analytic', got {!r}".format(method))
+
+        result[col] = mean
+        result[col + '_low'] = low
+        result[col + '_high'] = high
+    return result
+
+
+def score_ci(df, min_conf=0.0, weighted=True, ci=0.95, method='bootstrap', n_boot=1000, seed=0):
+    """
+    Confidence interval of the breed scores used by breed_rank.top_breeds.
+
+    Returns a DataFrame indexed by breed with score, score_low & score_high.
+    """
+    best = best_dog(df)
+    best = best[best.conf >= min_conf]
+    codes, breeds = pd.factorize(best.breed)
+    weights = best.conf.values if weighted else np.ones(len(best))
+    keep = codes >= 0
+    codes, weights = codes[keep], weights[keep]
+
+    score = np.bincount(codes, weights=weights, minlength=len(breeds))
+    if method == 'bootstrap':
+        low, high = _interval(bootstrap_totals(codes, weights, len(breeds), n_boot, seed), ci)
+    elif method == 'analytic':
+        # Poisson variance of a weighted count is the sum of squared weights
+        half = z_score(ci) * np.sqrt(np.bincount(codes, weights=weights ** 2, minlength=len(breeds)))
+        low, high = score - half, score + half
+    else:
+        raise ValueError("method must be 'bootstrap' or 'analytic', got {!r}".format(method))
+
+    return pd.DataFrame({'score': score, 'score_low': low, 'score_high': high},
+                        index=pd.Index(breeds, name='breed'))
+
+
+def xerr(stats, col):
+    """(2, n) array of distances to the interval bounds, for plt.barh(xerr=...)."""
+    return np.vstack([stats[col] - stats[col + '_low'], stats[col + '_high'] - stats[col]])
@@ -0,0 +1,133 @@
+"""
+The gather & clean steps of wrangle_act.py as plain functions, so they can be
+run by the pipeline runner (pipeline.py) or on micro-batches of new tweets.
+
+Each clean step returns a new DataFrame and leaves its input alone. None of
+them copy the input up front: with copy-on-write (see arrow_frames.py) the
+column selections & renames only share the input's buffers.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import requests
+
+import arrow_frames
+from dedup import dedup_shards
+from dog_stages import add_stages
+from near_dups import near_duplicates, drop_near_duplicates
+from timestamps import parse_timestamps, Q5_DROP_COLS
+from user_dim import UserDimension, fetch_time
+
+ARCHIVE_PATH = 'data/twitter-archive-enhanced.csv'
+IMAGE_PREDS_URL = "https://d17h27t6h515a5.cloudfront.net/topher/2017/August/599fd2ad_image-predictions/image-predictions.tsv"
+IMAGE_PREDS_PATH = 'data/image-predictions.tsv'
+TWEETS_GLOB = 'tweet*.json'
+TWEETS_PATH = 'tweet_latest.jsonl'
+MASTER_PATH = 'twitter_archive_master.csv'
+
+# Tidy #1 - columns kept from the API tweets, the user dicts live in the user dimension (see split_users)
+TWEET_COLS = ['created_at', 'id', 'full_text', 'display_text_range', 'retweet_count', 'favorite_count', 'user_key']
+
+# Q4 - (text in source, category), first match wins
+SOURCES = [('iphone', 'iphone'), ('vine', 'vine'), ('Twitter', 'twitter web client'), ('TweetDeck', 'TweetDeck')]
+
+
+# Gather
+
+def _read_csv(path, arrow=False, **kwargs):
+    if arrow:
+        return arrow_frames.read_csv(path, **kwargs)
+    return pd.read_csv(path, **kwargs)
+
+
+def gather_archive(path=ARCHIVE_PATH, arrow=False):
+    """Gather #1 - the local twitter archive. arrow=True reads into Arrow-backed columns."""
+    return _read_csv(path, arrow)
+
+
+def gather_image_preds(url=IMAGE_PREDS_URL, path=IMAGE_PREDS_PATH, download=True, arrow=False):
+    """Gather #2 - download image-predictions.tsv (or use the local copy)."""
+    if download:
+        req = requests.get(url)
+        req.raise_for_status()
+        with open(path, 'wb') as outfile:
+            outfile.write(req.content)
+    return _read_csv(path, arrow, sep='\t')
+
+
+def gather_tweets(pattern=TWEETS_GLOB, path=TWEETS_PATH, arrow=False):
+    """Gather #3 - the API tweets, latest fetch of every tweet across all tweet*.json files."""
+    from glob import glob
+
+    shards = glob(pattern)
+    if shards:
+        dedup_shards(shards, path)
+    tweets = pd.read_json(path, lines=True)
+    return arrow_frames.to_arrow(tweets) if arrow else tweets
+
+
+# Clean
+
+def clean_source(source):
+    """Q4 - replace the source html with one of 4 categories."""
+    source = source.fillna('')
+    conditions = [source.str.contains(text, regex=False).to_numpy(dtype=bool) for text, _ in SOURCES]
+    return pd.Series(np.select(conditions, [name for _, name in SOURCES], default=None),
+                     index=source.index, dtype=object)
+
+
+def clean_archive(archive):
+    """Q1 - Q5 on the twitter archive."""
+    # Q5 - remove retweets & their columns, done first so nothing is cleaned for nothing
+    df = archive[archive['retweeted_status_id'].isnull()]
+    df = df.drop(columns=[col for col in Q5_DROP_COLS if col in df.columns])
+    # Q1 - timestamp to datetime
+    df = parse_timestamps(df)
+    # Q2 - 'a' is not a name
+    df['name'] = df['name'].where(df['name'] != 'a')
+    # Q3 - dog stages from the text, 0 / 1 columns
+    df = add_stages(df)
+    # Q4 - short source categories
+    df['source'] = clean_source(df['source'])
+    return df
+
+
+def split_users(tweets, users=None, snapshot_time=None):
+    """
+    Replace the user dicts by user_key, returns {'tweets_keyed': ..., 'users': user table}.
+    The user snapshots are taken at snapshot_time, by default when the newest
+    TWEETS_GLOB shard (or TWEETS_PATH, which keeps the shards' mtime) was fetched.
+    """
+    from glob import glob
+
+    users = users if users is not None else UserDimension()
+    if snapshot_time is None:
+        sources = glob(TWEETS_GLOB) or [path for path in [TWEETS_PATH] if os.path.exists(path)]
+        snapshot_time = fetch_time(sources) if sources else None
+    keyed = users.split(tweets, snapshot_time=snapshot_time) if 'user' in tweets.columns else tweets
+    return {'tweets_keyed': keyed, 'users': users.frame()}
+
+
+def drop_near_dups(archive, **kwargs):
+    """Near-duplicate re-posts out of the archive, returns {'archive_unique': ..., 'near_dup_clusters': ...}."""
+    clusters = near_duplicates(archive, **kwargs)
+    return {'archive_unique': drop_near_duplicates(archive, clusters), 'near_dup_clusters': clusters}
+
+
+def clean_tweets(tweets, cols=TWEET_COLS):
+    """Tidy #1 & Q7 on the API tweets."""
+    df = tweets.loc[:, [col for col in cols if col in tweets.columns]]
+    df = df.rename(columns={'id': 'tweet_id'})
+    return parse_timestamps(df)
+
+
+def merge_all(archive, tweets, image_preds):
+    """Tidy #2 - merge the 3 datasets on tweet_id."""
+    return pd.merge(pd.merge(tweets, archive, on='tweet_id'), image_preds, on='tweet_id')
+
+
+def save_master(master, path=MASTER_PATH):
+    """Write the merged dataset to file."""
+    master.to_csv(path)
+    return os.path.abspath(path)
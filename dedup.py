@@ -0,0 +1,73 @@
+"""
+Deduplicate tweet JSONL shards on tweet_id, latest fetch wins.
+
+Re-running the Twitter gather or combining partial tweet.json files from a
+failed run gives duplicate tweet lines, which multiply rows in the
+pd.merge on tweet_id. dedup_shards() streams the shards newest first and
+keeps only the first (= latest) line seen for every id.
+
+Memory is bounded by the set of ids already written plus a single shard.
+"""
+import json
+import os
+
+import pandas as pd
+
+
+def latest_first(paths):
+    """Sort shard paths newest first by modification time."""
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def tweet_id(line):
+    """Top level 'id' of a tweet JSON line, None for blank or broken lines."""
+    try:
+        return json.loads(line)['id']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def iter_latest(paths, by_mtime=True):
+    """
+    Yield (tweet_id, line) once per tweet across all shards.
+
+    paths are read newest first (by mtime, or in the given order, newest first,
+    when by_mtime=False). Inside a shard later lines win over earlier ones.
+    """
+    if by_mtime:
+        paths = latest_first(paths)
+
+    seen = set()
+    for path in paths:
+        # only the current shard is held in memory, later lines overwrite earlier ones
+        shard = {}
+        with open(path) as infile:
+            for line in infile:
+                tid = tweet_id(line)
+                if tid is not None and tid not in seen:
+                    shard[tid] = line
+        for tid, line in shard.items():
+            seen.add(tid)
+            yield tid, line
+
+
+def dedup_shards(paths, out_path, by_mtime=True):
+    """
+    Write one line per tweet from all shards to out_path, returns counts.
+    out_path gets the newest shard's mtime, so it still tells when the tweets were fetched.
+    """
+    written = 0
+    with open(out_path, 'w') as outfile:
+        for tid, line in iter_latest(paths, by_mtime=by_mtime):
+            outfile.write(line if line.endswith('\n') else line + '\n')
+            written += 1
+    if paths:
+        newest = max(os.path.getmtime(path) for path in paths)
+        os.utime(out_path, (newest, newest))
+    return {'shards': len(paths), 'tweets': written}
+
+
+def upsert(existing, new, key='tweet_id'):
+    """Rows of new replace rows of existing with the same key, other rows are kept."""
+    combined = pd.concat([existing, new], ignore_index=True, sort=False)
+    return combined.drop_duplicates(subset=key, keep='last').reset_index(drop=True)
@@ -0,0 +1,57 @@
+"""
+Re-derive the dog stages (doggo, floofer, pupper, puppo) from tweet text.
+
+The archive's stage columns were extracted upstream and miss plurals and
+possessives ("doggos", "pupper's", "puppers"). Here all four stages are
+found with one compiled alternation regex in a single pass over the text
+and stored as a bitmask, so a tweet can carry several stages (row 200 is
+both a doggo & a floofer).
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+STAGES = ['doggo', 'floofer', 'pupper', 'puppo']
+
+# doggo -> 1, floofer -> 2, pupper -> 4, puppo -> 8
+STAGE_BITS = {stage: 1 << i for i, stage in enumerate(STAGES)}
+
+# one alternation for all stages, plural / possessive endings allowed
+STAGE_RE = re.compile(r"\b(" + "|".join(STAGES) + r")(?:s'|'s|s)?(?!\w)", re.IGNORECASE)
+
+
+def stage_mask(text):
+    """uint8 bitmask of the stages mentioned in each text, indexed like text."""
+    found = text.str.extractall(STAGE_RE)
+    mask = pd.Series(0, index=text.index, dtype=np.uint8)
+    if len(found):
+        bits = found[0].str.lower().map(STAGE_BITS).astype(np.uint8)
+        # the same stage twice in one tweet still counts once
+        pairs = pd.DataFrame({'row': bits.index.get_level_values(0), 'bit': bits.values}).drop_duplicates()
+        mask.loc[:] = pairs.groupby('row')['bit'].sum().reindex(text.index, fill_value=0).astype(np.uint8).values
+    return mask
+
+
+def stage_flags(mask):
+    """Expand a bitmask into 0/1 doggo, floofer, pupper, puppo columns."""
+    values = np.asarray(mask, dtype=np.uint8)
+    return pd.DataFrame({stage: ((values & bit) > 0).astype(np.int8) for stage, bit in STAGE_BITS.items()},
+                        index=getattr(mask, 'index', None))
+
+
+def stage_labels(mask, sep=','):
+    """Readable label per row, e.g. 'doggo,floofer', empty string for no stage."""
+    values = np.asarray(mask, dtype=np.uint8)
+    labels = np.array([sep.join(stage for stage, bit in STAGE_BITS.items() if code & bit) for code in range(16)],
+                      dtype=object)
+    return pd.Series(labels[values], index=getattr(mask, 'index', None))
+
+
+def add_stages(df, text_col='text'):
+    """Set stage_mask & the four 0/1 stage columns of df from its text."""
+    df['stage_mask'] = stage_mask(df[text_col])
+    flags = stage_flags(df['stage_mask'])
+    for stage in STAGES:
+        df[stage] = flags[stage]
+    return df
@@ -0,0 +1,90 @@
+"""
+Categorical encoding of the low-cardinality text columns.
+
+source (after Q4), name, p1/p2/p3 & similar columns hold one Python string
+per row for a handful (sources) to a few hundred (breeds) distinct values.
+encode_categories() finds such columns from a sample of rows and turns them
+into 'category' dtype, so groupby('p1') & value_counts work on integer codes.
+
+The categories are kept in data/categories.json and only ever appended to,
+so a value gets the same code in every run; p1, p2 & p3 share one 'breed'
+dictionary so their codes can be compared with each other.
+"""
+import json
+import os
+
+import pandas as pd
+
+CATEGORIES_PATH = 'data/categories.json'
+
+# columns that share one dictionary
+SHARED = {'p1': 'breed', 'p2': 'breed', 'p3': 'breed'}
+
+
+def is_text(col):
+    return col.dtype == object or pd.api.types.is_string_dtype(col.dtype)
+
+
+def low_cardinality(df, sample_rows=10000, max_ratio=0.75, max_categories=1000, random_state=0):
+    """Text columns whose sampled distinct values / rows is at most max_ratio."""
+    sample = df.sample(n=sample_rows, random_state=random_state) if len(df) > sample_rows else df
+    found = []
+    for name in df.columns:
+        col = sample[name]
+        if not is_text(col) or isinstance(col.dtype, pd.CategoricalDtype):
+            continue
+        values = col.dropna()
+        # dicts / lists (user, entities) can't be categories
+        if len(values) and not values.map(lambda v: isinstance(v, str)).all():
+            continue
+        n_unique = values.nunique()
+        if len(values) and n_unique <= max_categories and n_unique / len(values) <= max_ratio:
+            found.append(name)
+    return found
+
+
+def load_dictionaries(path=CATEGORIES_PATH):
+    if os.path.exists(path):
+        with open(path) as infile:
+            return json.load(infile)
+    return {}
+
+
+def save_dictionaries(dictionaries, path=CATEGORIES_PATH):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as outfile:
+        json.dump(dictionaries, outfile, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def encode_categories(df, columns=None, path=CATEGORIES_PATH, **detect):
+    """
+    Convert columns (default: low_cardinality(df, **detect)) to category dtype.
+
+    Returns (encoded copy of df, report of the memory per column in MB).
+    path=None uses fresh dictionaries and doesn't store them.
+    """
+    columns = low_cardinality(df, **detect) if columns is None else columns
+    dictionaries = load_dictionaries(path) if path else {}
+    out = df.copy()
+    rows = []
+    for name in columns:
+        key = SHARED.get(name, name)
+        known = dictionaries.get(key, [])
+        seen = set(known)
+        # new values go to the end, existing codes never move
+        new = sorted(value for value in pd.unique(df[name].dropna()) if value not in seen)
+        dictionaries[key] = known + [str(value) for value in new]
+
+        before = df[name].memory_usage(deep=True, index=False)
+        out[name] = pd.Categorical(df[name].astype(object), categories=dictionaries[key])
+        after = out[name].memory_usage(deep=True, index=False)
+        rows.append({'column': name, 'dictionary': key, 'categories': len(dictionaries[key]),
+                     'before_mb': before / 1e6, 'after_mb': after / 1e6})
+
+    if path and columns:
+        save_dictionaries(dictionaries, path)
+
+    report = pd.DataFrame(rows, columns=['column', 'dictionary', 'categories', 'before_mb', 'after_mb'])
+    report['saved_mb'] = report.before_mb - report.after_mb
+    return out, report
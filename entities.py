@@ -0,0 +1,107 @@
+"""
+Flatten entities / extended_entities into typed child tables.
+
+rt_tweets.loc[0, 'extended_entities'] & rt_tweets.loc[115, 'entities'] are
+nested dicts holding the media ids & types (photo, video, animated_gif),
+hashtags & mentions. EntityTables collects them into plain column lists
+while the JSON lines are parsed, so nothing is ever apply'd over dict
+columns:
+
+    media    - tweet_id, media_id, type, url, expanded_url, width, height, sizes
+    hashtags - tweet_id, hashtag
+    mentions - tweet_id, user_id, screen_name
+
+    tweets, tables = read_tweet_tables('tweet_latest.jsonl')
+"""
+import json
+import os
+
+import pandas as pd
+
+from tweet_reader import OPENERS
+from user_dim import UserDimension, as_snapshot, fetch_time
+
+MEDIA_COLS = ['tweet_id', 'media_id', 'type', 'url', 'expanded_url', 'width', 'height', 'sizes']
+HASHTAG_COLS = ['tweet_id', 'hashtag']
+MENTION_COLS = ['tweet_id', 'user_id', 'screen_name']
+
+
+class EntityTables(object):
+    """Column builders for the media, hashtag & mention tables."""
+
+    def __init__(self):
+        self.media = {col: [] for col in MEDIA_COLS}
+        self.hashtags = {col: [] for col in HASHTAG_COLS}
+        self.mentions = {col: [] for col in MENTION_COLS}
+
+    def add(self, tweet, pop=True):
+        """Collect the entities of one tweet dict (removed from it when pop)."""
+        get = tweet.pop if pop else tweet.get
+        tweet_id = tweet.get('id')
+        entities = get('entities', None) or {}
+        extended = get('extended_entities', None) or {}
+
+        # extended_entities lists every photo of a tweet, entities only the first one
+        seen = set()
+        for item in (extended.get('media') or entities.get('media') or []):
+            media_id = item.get('id')
+            if media_id in seen:
+                continue
+            seen.add(media_id)
+            large = (item.get('sizes') or {}).get('large') or {}
+            media = self.media
+            media['tweet_id'].append(tweet_id)
+            media['media_id'].append(media_id)
+            media['type'].append(item.get('type'))
+            media['url'].append(item.get('media_url_https') or item.get('media_url'))
+            media['expanded_url'].append(item.get('expanded_url'))
+            media['width'].append(large.get('w'))
+            media['height'].append(large.get('h'))
+            media['sizes'].append(json.dumps(item.get('sizes'), sort_keys=True) if item.get('sizes') else None)
+
+        for tag in entities.get('hashtags') or []:
+            self.hashtags['tweet_id'].append(tweet_id)
+            self.hashtags['hashtag'].append(tag.get('text'))
+
+        for mention in entities.get('user_mentions') or []:
+            self.mentions['tweet_id'].append(tweet_id)
+            self.mentions['user_id'].append(mention.get('id'))
+            self.mentions['screen_name'].append(mention.get('screen_name'))
+
+    def frames(self):
+        """{'media': ..., 'hashtags': ..., 'mentions': ...} DataFrames with typed columns."""
+        media = pd.DataFrame(self.media, columns=MEDIA_COLS)
+        media = media.astype({'tweet_id': 'int64', 'media_id': 'int64', 'type': 'category',
+                              'width': 'Int64', 'height': 'Int64'})
+        hashtags = pd.DataFrame(self.hashtags, columns=HASHTAG_COLS).astype({'tweet_id': 'int64'})
+        mentions = pd.DataFrame(self.mentions, columns=MENTION_COLS).astype({'tweet_id': 'int64', 'user_id': 'Int64'})
+        return {'media': media, 'hashtags': hashtags, 'mentions': mentions}
+
+
+def read_tweet_tables(path, users=None, snapshot_time=None):
+    """
+    One pass over a tweet JSONL file (or compressed shard, see tweet_reader):
+    tweets (with user_key, without the nested user / entities dicts), plus the
+    user, media, hashtag & mention tables. The user snapshots are taken at
+    snapshot_time, by default the file's fetch_time.
+    """
+    users = users if users is not None else UserDimension()
+    snapshot_time = as_snapshot(snapshot_time if snapshot_time is not None else fetch_time(path))
+    tables = EntityTables()
+    records = []
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            tweet = json.loads(line)
+            tweet['user_key'] = users.key(tweet.pop('user', None), snapshot_time)
+            tables.add(tweet)
+            records.append(tweet)
+
+    tweets = pd.DataFrame.from_records(records)
+    if 'user_key' in tweets.columns:
+        tweets['user_key'] = tweets['user_key'].astype('Int64')
+    result = tables.frames()
+    result['users'] = users.frame()
+    return tweets, result
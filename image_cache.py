@@ -0,0 +1,164 @@
+"""
+Fetch the jpg_url images from image-predictions.tsv into a local cache.
+
+Images are downloaded concurrently over a pooled requests Session with
+retries and stored content-addressed (sha256 of the bytes), so tweets that
+reuse the same media - or different urls with identical bytes - are
+stored once. data/images/index.csv maps each url to its hash.
+
+    stats = fetch_images(image_preds.jpg_url)
+    make_thumbnails(cache_paths(image_preds.jpg_url))
+
+Thumbnails need Pillow.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from timeit import default_timer as timer
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CACHE_DIR = 'data/images'
+INDEX_COLS = ['url', 'sha256', 'bytes']
+
+
+def make_session(pool_size=16, retries=3, backoff=0.5):
+    """requests Session with a connection pool & retries on connection errors / 429 / 5xx."""
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def blob_path(digest, cache_dir=CACHE_DIR, ext='.jpg'):
+    """Cache file of a sha256 digest, e.g. data/images/ab/abcdef....jpg"""
+    return os.path.join(cache_dir, digest[:2], digest + ext)
+
+
+def index_path(cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, 'index.csv')
+
+
+def load_index(cache_dir=CACHE_DIR):
+    """url -> sha256 index of the cache, empty DataFrame if there is none yet."""
+    path = index_path(cache_dir)
+    if os.path.exists(path):
+        return pd.read_csv(path)
+    return pd.DataFrame(columns=INDEX_COLS)
+
+
+def store(content, cache_dir=CACHE_DIR):
+    """Write content under its hash (once) and return the hash."""
+    digest = hashlib.sha256(content).hexdigest()
+    path = blob_path(digest, cache_dir)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp name first so readers never see half an image
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as outfile:
+            outfile.write(content)
+        os.replace(tmp, path)
+    return digest
+
+
+def fetch_one(session, url, timeout=10):
+    """Download a single url, returns (url, content or None, error or None)."""
+    try:
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return url, response.content, None
+    except requests.RequestException as e:
+        return url, None, str(e)
+
+
+def fetch_images(urls, cache_dir=CACHE_DIR, workers=16, timeout=10, session=None):
+    """
+    Download every url not cached yet, returns a dict of stats incl. images_per_sec.
+
+    Each distinct url is requested once, even if several tweets share it.
+    """
+    index = load_index(cache_dir)
+    todo = pd.unique(pd.Series(urls).dropna())
+    cached = set(index.url)
+    todo = [url for url in todo if url not in cached]
+    session = session or make_session(pool_size=workers)
+
+    rows, failed, n_bytes = [], {}, 0
+    start = timer()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for url, content, error in pool.map(partial(fetch_one, session, timeout=timeout), todo):
+            if error is not None:
+                failed[url] = error
+                continue
+            rows.append({'url': url, 'sha256': store(content, cache_dir), 'bytes': len(content)})
+            n_bytes += len(content)
+    elapsed = timer() - start
+
+    if rows:
+        index = pd.concat([index, pd.DataFrame(rows, columns=INDEX_COLS)], ignore_index=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        index.to_csv(index_path(cache_dir), index=False)
+
+    return {
+        'requested': len(todo),
+        'fetched': len(rows),
+        'failed': failed,
+        'unique_blobs': index.sha256.nunique(),
+        'seconds': elapsed,
+        'images_per_sec': len(rows) / elapsed if elapsed else 0.0,
+        'mb_per_sec': n_bytes / 1e6 / elapsed if elapsed else 0.0,
+    }
+
+
+def cache_paths(urls, cache_dir=CACHE_DIR):
+    """Cached file for each url (NaN where not cached), indexed like urls."""
+    urls = pd.Series(urls)
+    lookup = load_index(cache_dir).drop_duplicates('url').set_index('url').sha256
+    digests = urls.map(lookup)
+    return digests.map(lambda digest: blob_path(digest, cache_dir), na_action='ignore')
+
+
+def thumbnail(path, size=(128, 128), suffix='.thumb.jpg'):
+    """Write a thumbnail next to a cached image, returns its path."""
+    from PIL import Image
+
+    out = path[:-len('.jpg')] + suffix if path.endswith('.jpg') else path + suffix
+    if not os.path.exists(out):
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            img.thumbnail(size)
+            img.save(out, 'JPEG')
+    return out
+
+
+def make_thumbnails(paths, size=(128, 128), processes=None):
+    """Thumbnail every distinct cached image in a process pool."""
+    paths = pd.unique(pd.Series(paths).dropna())
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(partial(thumbnail, size=size), paths, chunksize=16))
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler that doesn't log every request."""
+
+    def log_message(self, *args):
+        pass
+
+
+def local_server(directory, port=0):
+    """
+    Serve directory over http on localhost in a background thread, for testing the fetcher.
+    Returns (server, base_url); call server.shutdown() when done.
+    """
+    handler = partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
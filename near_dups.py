@@ -0,0 +1,155 @@
+"""
+Near-duplicate tweets: MinHash signatures over text shingles + LSH buckets.
+
+Q5 only removes formal retweets. Re-posts of the same dog with slightly
+different text (another t.co link, a fixed typo, "Here's" vs "This is")
+still count twice for the breed & name stats. Here every text is cut into
+character k-shingles, the shingles are min-hashed with num_perm hash
+functions (one numpy expression over all shingles of a chunk of tweets) and
+the signatures are split into bands: tweets sharing a whole band land in the
+same bucket. Each bucket member is compared with the bucket's first member
+only, so the work grows with tweets x bands, not tweets squared.
+
+    clusters = near_duplicates(twitterDF)          # tweet_id, cluster, size, keep
+    twitterDF = drop_near_duplicates(twitterDF, clusters)
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# t.co links differ between re-posts of the same tweet
+LINK_RE = r'https?://\S+'
+
+
+def normalize(text):
+    """Lowercase text without links & repeated whitespace."""
+    text = text.fillna('').str.lower().str.replace(LINK_RE, ' ', regex=True)
+    return text.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def shingle_hashes(texts, k=5):
+    """
+    (doc, hash) arrays of the character k-shingles of every text, hashed as
+    a polynomial over the code points. Texts shorter than k are one (padded) shingle.
+    """
+    texts = [text.ljust(k) for text in texts]
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    n_shingles = lengths - k + 1
+    doc = np.repeat(np.arange(len(texts)), n_shingles)
+    # position of every shingle in codes: its doc's start + offset in the doc
+    offsets = np.arange(len(doc)) - np.repeat(np.cumsum(n_shingles) - n_shingles, n_shingles)
+    pos = np.repeat(starts, n_shingles) + offsets
+    h = np.zeros(len(pos), dtype=np.uint64)
+    for j in range(k):
+        h = h * np.uint64(1000003) + codes[pos + j]
+    return doc, h
+
+
+def minhash(texts, k=5, num_perm=128, seed=1, chunk=20000, perm_block=8, workers=4):
+    """
+    (len(texts), num_perm) uint32 signatures. Texts are shingled & hashed
+    about chunk shingles at a time, perm_block hash functions at once, so
+    memory stays at ~workers * chunk * perm_block * 8 bytes whatever the
+    number of tweets. numpy releases the GIL, chunks run in a thread pool.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 61, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 61, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    mean_len = max(1, sum(len(text) for text in texts[:1000]) // max(1, min(len(texts), 1000)))
+    step = max(1, chunk // mean_len)
+
+    def sign(first):
+        doc, h = shingle_hashes(texts[first:first + step], k)
+        starts = np.flatnonzero(np.concatenate([[True], doc[1:] != doc[:-1]]))
+        values = np.empty((perm_block, len(h)), dtype=np.uint64)
+        for p in range(0, num_perm, perm_block):
+            # multiply-shift hashing, the top 32 bits of a * h + b (mod 2**64), in place
+            block = values[:len(a[p:p + perm_block])]
+            np.multiply(a[p:p + perm_block, None], h[None, :], out=block)
+            block += b[p:p + perm_block, None]
+            block >>= np.uint64(32)
+            signatures[first:first + step, p:p + perm_block] = np.minimum.reduceat(block, starts, axis=1).T
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(sign, range(0, len(texts), step)))
+    return signatures
+
+
+def lsh_candidates(signatures, bands=16):
+    """(i, j) index pairs sharing a band: j is linked to the first doc i of each bucket."""
+    n_docs, num_perm = signatures.shape
+    if not n_docs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    rows = num_perm // bands
+    left, right = [], []
+    weights = np.random.default_rng(0).integers(1, 1 << 63, size=rows, dtype=np.uint64)
+    for band in range(bands):
+        part = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (part * weights).sum(axis=1) + np.uint64(band)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+        first = order[np.flatnonzero(new_bucket)][np.cumsum(new_bucket) - 1]
+        linked = ~new_bucket
+        left.append(first[linked])
+        right.append(order[linked])
+    left, right = np.concatenate(left), np.concatenate(right)
+    if not len(left):
+        return left, right
+    # the same pair is usually found in several bands
+    pairs = np.sort(left * n_docs + right)
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+    return pairs // n_docs, pairs % n_docs
+
+
+def components(n, left, right):
+    """Connected component label (smallest member) of each of n nodes."""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        new = labels.copy()
+        np.minimum.at(new, left, low)
+        np.minimum.at(new, right, low)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def near_duplicates(df, text_col='text', id_col='tweet_id', threshold=0.8, k=5, num_perm=128, bands=16):
+    """
+    Clusters of tweets whose text shingles have an estimated Jaccard similarity
+    >= threshold with another member. One row per tweet in a cluster of 2 or more:
+    tweet_id, cluster (smallest tweet_id of the cluster), size & keep (True for
+    the oldest tweet of each cluster). Texts shorter than k after normalize()
+    (empty or links only) are never clustered, they would all share one shingle.
+    """
+    texts = normalize(df[text_col])
+    usable = (texts.str.len() >= k).to_numpy()
+    texts = texts[usable].tolist()
+    signatures = minhash(texts, k, num_perm)
+    left, right = lsh_candidates(signatures, bands)
+    # LSH only proposes pairs, the signatures estimate their similarity
+    similar = np.concatenate([(signatures[left[i:i + 100000]] == signatures[right[i:i + 100000]]).mean(axis=1)
+                              for i in range(0, len(left), 100000)] or [np.zeros(0)]) >= threshold
+    labels = components(len(texts), left[similar], right[similar])
+
+    ids = df[id_col].to_numpy()[usable]
+    out = pd.DataFrame({id_col: ids, 'label': labels})
+    out['size'] = out.groupby('label')[id_col].transform('size')
+    out = out[out['size'] > 1].copy()
+    out['cluster'] = out.groupby('label')[id_col].transform('min')
+    # tweet ids grow with time, the smallest id is the original post
+    out['keep'] = out[id_col] == out['cluster']
+    return out[[id_col, 'cluster', 'size', 'keep']].sort_values(['cluster', id_col]).reset_index(drop=True)
+
+
+def drop_near_duplicates(df, clusters=None, id_col='tweet_id', **kwargs):
+    """df without the later tweets of each near-duplicate cluster."""
+    clusters = near_duplicates(df, id_col=id_col, **kwargs) if clusters is None else clusters
+    drop = clusters.loc[~clusters['keep'], id_col]
+    return df[~df[id_col].isin(drop)]
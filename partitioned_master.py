@@ -0,0 +1,272 @@
+"""
+Master output partitioned by year & month of 'timestamp' (Hive style).
+
+    twitter_archive_master/
+        year=2017/month=07/part.parquet
+        year=2017/month=08/part.parquet
+        _stats.json        <- rows & min/max timestamp and tweet_id per file
+
+read_partitioned() uses the partition paths & _stats.json to skip files
+outside a requested date or tweet_id range, and for parquet the row-group
+statistics to skip row groups inside a file. upsert_partitioned() only
+rewrites the partitions the new tweets fall into.
+
+Other predicates can be passed as filters, (column, op, value) tuples that
+must all hold, e.g. [('p1', 'in', ['pug', 'chow']), ('rating_numerator', '>=', 12)].
+They are applied to each file as it's read and also skip parquet row groups.
+
+Parquet needs pyarrow; csv works with pandas only.
+"""
+import json
+import operator
+import os
+
+import pandas as pd
+
+from dedup import upsert
+from shared_master import arrow_safe
+
+MASTER_ROOT = 'twitter_archive_master'
+STATS_FILE = '_stats.json'
+ROW_GROUP_SIZE = 100000
+
+OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def _file_name(fmt):
+    return 'part.' + fmt
+
+
+def _utc(value):
+    if value is None:
+        return None
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def load_stats(root=MASTER_ROOT):
+    path = os.path.join(root, STATS_FILE)
+    if os.path.exists(path):
+        with open(path) as infile:
+            return json.load(infile)
+    return {}
+
+
+def save_stats(stats, root=MASTER_ROOT):
+    tmp = os.path.join(root, STATS_FILE + '.tmp')
+    with open(tmp, 'w') as outfile:
+        json.dump(stats, outfile, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(root, STATS_FILE))
+
+
+def _write_file(part, path, fmt):
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        # sorted by time, so each row group covers a narrow time range for pruning
+        part.to_parquet(tmp, index=False, row_group_size=ROW_GROUP_SIZE, engine='pyarrow')
+    else:
+        part.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def filter_mask(df, filters):
+    """Boolean Series: rows of df matching all (column, op, value) filters."""
+    keep = pd.Series(True, index=df.index)
+    for col, op, value in filters or ():
+        if op == 'in':
+            keep &= df[col].isin(value)
+        elif op == 'not in':
+            keep &= ~df[col].isin(value)
+        elif op in OPS:
+            keep &= OPS[op](df[col], value).fillna(False).astype(bool)
+        else:
+            raise ValueError('unknown filter op {!r}'.format(op))
+    return keep
+
+
+def arrow_filter(filters):
+    """The filters as a pyarrow.compute expression, None if there are none."""
+    import pyarrow.compute as pc
+
+    expression = None
+    for col, op, value in filters or ():
+        field = pc.field(col)
+        if op == 'in':
+            term = field.isin(list(value))
+        elif op == 'not in':
+            term = ~field.isin(list(value))
+        elif op in OPS:
+            term = OPS[op](field, value)
+        else:
+            raise ValueError('unknown filter op {!r}'.format(op))
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def _read_file(path, fmt, time_col, columns=None, start=None, end=None, id_range=None, id_col='tweet_id',
+               filters=None):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        groups = [i for i in range(parquet.num_row_groups)
+                  if _row_group_overlaps(parquet.metadata.row_group(i), time_col, id_col, start, end, id_range,
+                                         filters)]
+        if not groups:
+            return None
+        table = parquet.read_row_groups(groups, columns=columns)
+        if filters:
+            # filtered in Arrow, only the matching rows are converted to pandas
+            table = table.filter(arrow_filter(filters))
+        return table.to_pandas()
+
+    df = pd.read_csv(path, usecols=columns)
+    if time_col in df.columns:
+        df[time_col] = pd.to_datetime(df[time_col], utc=True)
+    return df[filter_mask(df, filters)] if filters else df
+
+
+def _stats_exclude(low, high, op, value):
+    """True if no value in [low, high] can satisfy op value."""
+    try:
+        if op == '==':
+            return value < low or value > high
+        if op == 'in':
+            return all(v < low or v > high for v in value)
+        if op in ('<', '<='):
+            return low > value if op == '<=' else low >= value
+        if op in ('>', '>='):
+            return high < value if op == '>=' else high <= value
+    except TypeError:
+        pass
+    return False
+
+
+def _row_group_overlaps(meta, time_col, id_col, start, end, id_range, filters=None):
+    """False only if the row group's statistics prove it has no matching rows."""
+    for i in range(meta.num_columns):
+        column = meta.column(i)
+        stats = column.statistics
+        if stats is None or not stats.has_min_max:
+            continue
+        if column.path_in_schema == time_col and (start is not None or end is not None):
+            low, high = _utc(stats.min), _utc(stats.max)
+            if (start is not None and high < start) or (end is not None and low > end):
+                return False
+        if column.path_in_schema == id_col and id_range is not None:
+            if stats.max < id_range[0] or stats.min > id_range[1]:
+                return False
+        for col, op, value in filters or ():
+            if col == column.path_in_schema and _stats_exclude(stats.min, stats.max, op, value):
+                return False
+    return True
+
+
+def write_partitioned(df, root=MASTER_ROOT, fmt='csv', time_col='timestamp', id_col='tweet_id', partitions=None):
+    """
+    Write df one file per year/month partition & update _stats.json.
+
+    partitions - only write these partitions (e.g. 'year=2017/month=08'), default all of df
+    Returns the partitions written.
+    """
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError("fmt must be 'csv' or 'parquet', got {!r}".format(fmt))
+    df = arrow_safe(df) if fmt == 'parquet' else df
+    times = pd.to_datetime(df[time_col], utc=True)
+    keys = times.dt.strftime('year=%Y/month=%m')
+    stats = load_stats(root) if os.path.isdir(root) else {}
+
+    written = []
+    for key, part in df.assign(**{time_col: times}).groupby(keys.values, sort=True):
+        if partitions is not None and key not in partitions:
+            continue
+        part = part.sort_values(time_col, kind='stable')
+        rel = key + '/' + _file_name(fmt)
+        os.makedirs(os.path.join(root, key), exist_ok=True)
+        _write_file(part, os.path.join(root, rel), fmt)
+        stats[rel] = {
+            'rows': int(len(part)),
+            'min_time': part[time_col].min().isoformat(),
+            'max_time': part[time_col].max().isoformat(),
+            'min_id': int(part[id_col].min()),
+            'max_id': int(part[id_col].max()),
+            'format': fmt,
+        }
+        written.append(key)
+    save_stats(stats, root)
+    return written
+
+
+def upsert_partitioned(new, root=MASTER_ROOT, fmt='csv', time_col='timestamp', id_col='tweet_id'):
+    """
+    Merge new tweets into the stored partitions they fall in, newer rows win.
+    Partitions without new tweets are not read or rewritten. Returns those rewritten.
+    """
+    keys = pd.to_datetime(new[time_col], utc=True).dt.strftime('year=%Y/month=%m')
+    affected = sorted(set(keys))
+    existing = []
+    for key in affected:
+        path = os.path.join(root, key, _file_name(fmt))
+        if os.path.exists(path):
+            existing.append(_read_file(path, fmt, time_col))
+    new = new.assign(**{time_col: pd.to_datetime(new[time_col], utc=True)})
+    merged = upsert(pd.concat(existing, ignore_index=True), new, key=id_col) if existing else new
+    return write_partitioned(merged, root, fmt, time_col, id_col, partitions=set(affected))
+
+
+def iter_partitioned(root=MASTER_ROOT, start=None, end=None, id_range=None, columns=None,
+                     time_col='timestamp', id_col='tweet_id', filters=None, newest_first=False, skip=None):
+    """
+    The matching rows of read_partitioned() one file at a time, as (stats entry, DataFrame).
+
+    newest_first - yield the files with the latest max_time first
+    skip         - called with each file's _stats.json entry before it's read, True skips the file
+    """
+    start, end = _utc(start), _utc(end)
+    stats = load_stats(root)
+    if columns is not None:
+        # the filter columns are needed to apply the exact filters
+        read_cols = list(dict.fromkeys(list(columns) + [time_col, id_col] + [col for col, _, _ in filters or ()]))
+    else:
+        read_cols = None
+
+    entries = sorted(stats.items(), key=lambda item: item[1]['max_time'] if newest_first else item[0],
+                     reverse=newest_first)
+    for rel, info in entries:
+        if start is not None and _utc(info['max_time']) < start:
+            continue
+        if end is not None and _utc(info['min_time']) > end:
+            continue
+        if id_range is not None and (info['max_id'] < id_range[0] or info['min_id'] > id_range[1]):
+            continue
+        if skip is not None and skip(info):
+            continue
+        df = _read_file(os.path.join(root, rel), info['format'], time_col, read_cols, start, end, id_range, id_col,
+                        filters)
+        if df is None:
+            continue
+        df[time_col] = pd.to_datetime(df[time_col], utc=True)
+        keep = pd.Series(True, index=df.index)
+        if start is not None:
+            keep &= df[time_col] >= start
+        if end is not None:
+            keep &= df[time_col] <= end
+        if id_range is not None:
+            keep &= df[id_col].between(*id_range)
+        df = df[keep].reset_index(drop=True)
+        yield info, (df[list(columns)] if columns is not None else df)
+
+
+def read_partitioned(root=MASTER_ROOT, start=None, end=None, id_range=None, columns=None,
+                     time_col='timestamp', id_col='tweet_id', filters=None):
+    """
+    Rows with start <= timestamp <= end and id_range[0] <= tweet_id <= id_range[1]
+    that match all filters.
+
+    Files whose _stats.json range can't match are never opened; parquet row
+    groups are skipped on their own statistics.
+    """
+    frames = [df for _, df in iter_partitioned(root, start, end, id_range, columns, time_col, id_col, filters)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
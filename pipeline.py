@@ -0,0 +1,223 @@
+"""
+A small DAG runner for the wrangling stages.
+
+Each Stage names the artifacts it reads (inputs, passed to func positionally
+in that order) and writes (outputs; func returns a dict of them, or the value
+itself when there is only one). A stage starts as soon as all of its inputs
+exist, so the 3 gathers and the per-source cleans run concurrently and the
+end-to-end time is the longest branch instead of the sum of all stages.
+
+    pipe = wrangle_pipeline()
+    pipe.run(dry_run=True)               # plan only
+    results = pipe.run()                 # everything
+    pipe.run(targets=['master'], reuse=results)   # re-run what 'master' needs, reuse the rest
+    pipe.critical_path()
+"""
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+import tracemalloc
+from timeit import default_timer as timer
+
+import arrow_frames
+import cleaning
+
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'outputs'])
+
+
+def _call(func, args):
+    return func(*args)
+
+
+class Pipeline(object):
+    """
+    Stages wired together by the names of their inputs & outputs.
+
+    trace_memory  - tracemalloc on while run() runs & the stages run one at a time in
+                    a single thread: tracemalloc's peak & the Arrow memory pool are
+                    process wide, so the Profiled stages' numbers are only their own
+                    when no other stage runs at the same time
+    copy_on_write - pandas copy-on-write on while run() runs
+    """
+
+    def __init__(self, stages=(), trace_memory=False, copy_on_write=False):
+        self.stages = {}
+        self.producer = {}
+        self.timings = {}
+        self.trace_memory = trace_memory
+        self.copy_on_write = copy_on_write
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError("duplicate stage {!r}".format(stage.name))
+        for output in stage.outputs:
+            if output in self.producer:
+                raise ValueError("{!r} is produced by both {!r} and {!r}".format(
+                    output, self.producer[output], stage.name))
+            self.producer[output] = stage.name
+        self.stages[stage.name] = stage
+        return stage
+
+    def stage(self, inputs=(), outputs=(), name=None):
+        """Decorator form of add()."""
+        def register(func):
+            self.add(Stage(name or func.__name__, func, tuple(inputs), tuple(outputs)))
+            return func
+        return register
+
+    def upstream(self, name):
+        """Names of the stages name directly depends on."""
+        return {self.producer[item] for item in self.stages[name].inputs if item in self.producer}
+
+    def order(self, names=None):
+        """Stages in dependency order (raises ValueError on cycles or missing inputs)."""
+        names = set(self.stages) if names is None else set(names)
+        done, ordered = set(), []
+        while len(ordered) < len(names):
+            # dependencies outside names are reused artifacts, they don't hold a stage back
+            ready = sorted(name for name in names - done if self.upstream(name) & names <= done)
+            if not ready:
+                raise ValueError("cycle or missing producer among stages {}".format(sorted(names - done)))
+            ordered.extend(ready)
+            done.update(ready)
+        return ordered
+
+    def needed(self, targets=None, reuse=None):
+        """Stages to run to produce targets (stage or artifact names), skipping artifacts in reuse."""
+        reuse = reuse or {}
+        if targets is None:
+            wanted = set(self.stages)
+        else:
+            wanted = {self.producer.get(target, target) for target in targets}
+            missing = wanted - set(self.stages)
+            if missing:
+                raise ValueError("unknown targets {}".format(sorted(missing)))
+
+        todo, stack = set(), list(wanted)
+        while stack:
+            name = stack.pop()
+            if name in todo:
+                continue
+            todo.add(name)
+            for item in self.stages[name].inputs:
+                if item not in reuse and item in self.producer:
+                    stack.append(self.producer[item])
+        return todo
+
+    def run(self, targets=None, reuse=None, dry_run=False, workers=4, processes=False):
+        """
+        Run the stages needed for targets (default: all), independent ones in parallel.
+
+        reuse     - dict of artifacts from an earlier run, their stages are not re-run
+        dry_run   - only return the stages that would run, in order
+        processes - use a process pool instead of threads (stage functions must be picklable)
+        Returns a dict of all artifacts (reused ones included).
+        """
+        artifacts = dict(reuse or {})
+        todo = self.needed(targets, artifacts)
+        plan = self.order(todo)
+        if dry_run:
+            return plan
+
+        missing = {item for name in todo for item in self.stages[name].inputs
+                   if item not in self.producer and item not in artifacts}
+        if missing:
+            raise ValueError("no stage produces {} & they were not passed in reuse".format(sorted(missing)))
+
+        self.timings = {}
+        if self.trace_memory:
+            workers, processes = 1, False
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        try:
+            with arrow_frames.copy_on_write_scope() if self.copy_on_write else nullcontext():
+                self._execute(plan, artifacts, workers, processes)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        return artifacts
+
+    def _execute(self, plan, artifacts, workers, processes):
+        pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        pending, running = set(plan), {}
+        with pool_class(max_workers=workers) as pool:
+            while pending or running:
+                for name in sorted(pending):
+                    # no more than workers submitted, so a stage's start time is when it really starts
+                    if len(running) >= workers:
+                        break
+                    stage = self.stages[name]
+                    if all(item in artifacts for item in stage.inputs):
+                        args = [artifacts[item] for item in stage.inputs]
+                        running[pool.submit(_call, stage.func, args)] = (name, timer())
+                        pending.discard(name)
+                if not running:
+                    raise ValueError("stages {} can't run, inputs missing".format(sorted(pending)))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, start = running.pop(future)
+                    result = future.result()
+                    self.timings[name] = (start, timer())
+                    outputs = self.stages[name].outputs
+                    if len(outputs) == 1:
+                        result = {outputs[0]: result}
+                    artifacts.update({item: result[item] for item in outputs})
+
+    def critical_path(self):
+        """
+        Longest chain of stage durations of the last run.
+        Returns (total seconds, [stage names]).
+        """
+        durations = {name: end - start for name, (start, end) in self.timings.items()}
+        best = {}
+        for name in self.order(durations):
+            before = [best[dep] for dep in self.upstream(name) if dep in best]
+            longest = max(before, key=lambda item: item[0]) if before else (0.0, [])
+            best[name] = (longest[0] + durations[name], longest[1] + [name])
+        if not best:
+            return 0.0, []
+        return max(best.values(), key=lambda item: item[0])
+
+    def report(self):
+        """Start, end & duration of every stage of the last run, seconds from the first start."""
+        if not self.timings:
+            return []
+        zero = min(start for start, _ in self.timings.values())
+        rows = [(name, start - zero, end - zero, end - start) for name, (start, end) in self.timings.items()]
+        return sorted(rows, key=lambda row: row[1])
+
+
+def wrangle_pipeline(download=True, arrow=False, stats=None, near_dups=False):
+    """
+    The wrangle_act.py gather -> clean -> merge -> save flow as a Pipeline.
+
+    arrow - exchange Arrow-backed DataFrames with copy-on-write on (see arrow_frames.py)
+    stats - dict that collects arrow_frames.profile_stage() stats per stage, e.g. peak_mb,
+            arrow_mb & copied_columns; the stages then run serially so each stage's
+            memory is measured alone (the end-to-end time is the sum of the stages)
+    near_dups - drop near-duplicate re-posts from the cleaned archive before the merge
+                (see near_dups.py), their clusters are the 'near_dup_clusters' artifact
+    """
+    archive = 'archive_unique' if near_dups else 'archive_clean'
+    stages = [
+        Stage('gather_archive', partial(cleaning.gather_archive, arrow=arrow), (), ('archive',)),
+        Stage('gather_image_preds', partial(cleaning.gather_image_preds, download=download, arrow=arrow),
+              (), ('image_preds',)),
+        Stage('gather_tweets', partial(cleaning.gather_tweets, arrow=arrow), (), ('tweets',)),
+        Stage('clean_archive', cleaning.clean_archive, ('archive',), ('archive_clean',)),
+        Stage('split_users', cleaning.split_users, ('tweets',), ('tweets_keyed', 'users')),
+        Stage('clean_tweets', cleaning.clean_tweets, ('tweets_keyed',), ('tweets_clean',)),
+        Stage('merge', cleaning.merge_all, (archive, 'tweets_clean', 'image_preds'), ('master',)),
+        Stage('save_master', cleaning.save_master, ('master',), ('master_path',)),
+    ]
+    if near_dups:
+        stages.insert(4, Stage('near_dups', cleaning.drop_near_dups, ('archive_clean',),
+                               ('archive_unique', 'near_dup_clusters')))
+    if stats is not None:
+        stages = [stage._replace(func=arrow_frames.Profiled(stage.name, stage.func, stats)) for stage in stages]
+    return Pipeline(stages, trace_memory=stats is not None, copy_on_write=arrow)
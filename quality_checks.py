@@ -0,0 +1,98 @@
+"""
+Declarative data-quality checks for the WeRateDogs tables.
+
+Replaces the ad-hoc "Test" cells, e.g. twitterDF[twitterDF.name == 'a'] or
+mainDF[mainDF.tweet_id.duplicated()], with a list of checks that are all
+evaluated together and returned as one report DataFrame.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# kind is one of: 'unique', 'not_null', 'null', 'allowed', 'not_in', 'range'
+Check = namedtuple('Check', ['name', 'kind', 'column', 'args'])
+Check.__new__.__defaults__ = (None,)
+
+STAGE_COLS = ['doggo', 'floofer', 'pupper', 'puppo']
+
+# twitterDF after Q1 - Q5
+ARCHIVE_CHECKS = [
+    Check('tweet_id unique', 'unique', 'tweet_id'),
+    Check('tweet_id present', 'not_null', 'tweet_id'),
+    Check("name not 'a'", 'not_in', 'name', ('a',)),
+    Check('rating_numerator 0-20', 'range', 'rating_numerator', (0, 20)),
+    Check('rating_denominator is 10', 'range', 'rating_denominator', (10, 10)),
+    Check('no retweets', 'null', 'retweeted_status_id'),
+] + [Check(stage + ' is 0/1', 'allowed', stage, (0, 1)) for stage in STAGE_COLS]
+
+# new_tweets_df2, after both merges
+MASTER_CHECKS = ARCHIVE_CHECKS + [
+    Check('jpg_url present', 'not_null', 'jpg_url'),
+    Check('p1 present', 'not_null', 'p1'),
+    Check('favorite_count present', 'not_null', 'favorite_count'),
+    Check('retweet_count present', 'not_null', 'retweet_count'),
+    Check('p1_conf 0-1', 'range', 'p1_conf', (0, 1)),
+]
+
+REPORT_COLS = ['check', 'column', 'checked', 'failed', 'passed', 'sample_ids']
+
+
+def failures(df, check):
+    """Boolean array, True for each row of df that fails check."""
+    col = df[check.column]
+    if check.kind == 'unique':
+        return col.duplicated(keep=False).values
+    if check.kind == 'not_null':
+        return col.isnull().values
+    if check.kind == 'null':
+        return col.notnull().values
+    if check.kind == 'allowed':
+        return ~col.isin(check.args).values
+    if check.kind == 'not_in':
+        return col.isin(check.args).values
+    if check.kind == 'range':
+        low, high = check.args
+        values = pd.to_numeric(col, errors='coerce')
+        return (values.isnull() | (values < low) | (values > high)).values
+    raise ValueError("unknown check kind {!r}".format(check.kind))
+
+
+def run_checks(df, checks=ARCHIVE_CHECKS, row_budget=None, n_examples=5, random_state=0):
+    """
+    Evaluate all checks against df and return a report, one row per check.
+
+    row_budget - if set & df is larger, run on a random sample of that many rows.
+                 'unique' results are then only a lower bound on duplicates.
+    Checks against columns df does not have are skipped.
+    """
+    if row_budget is not None and len(df) > row_budget:
+        df = df.sample(n=row_budget, random_state=random_state)
+
+    checks = [check for check in checks if check.column in df.columns]
+    if not checks:
+        return pd.DataFrame(columns=REPORT_COLS)
+
+    # one (checks x rows) matrix, counted in a single reduction
+    failed = np.vstack([failures(df, check) for check in checks])
+    counts = failed.sum(axis=1)
+
+    ids = df['tweet_id'].values if 'tweet_id' in df.columns else df.index.values
+    report = pd.DataFrame({
+        'check': [check.name for check in checks],
+        'column': [check.column for check in checks],
+        'checked': len(df),
+        'failed': counts,
+        'passed': counts == 0,
+        'sample_ids': [list(ids[row][:n_examples]) if n else [] for row, n in zip(failed, counts)],
+    }, columns=REPORT_COLS)
+    return report
+
+
+def assert_checks(df, checks=ARCHIVE_CHECKS, **kwargs):
+    """Run checks & raise AssertionError listing the ones that failed."""
+    report = run_checks(df, checks, **kwargs)
+    bad = report[~report.passed]
+    if len(bad):
+        raise AssertionError("failed data-quality checks:\n" + bad.to_string(index=False))
+    return report
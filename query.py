@@ -0,0 +1,327 @@
+"""
+Lazy queries over the master data: build a plan, optimize it, run only what's needed.
+
+    name_by_avgs = (Query.partitioned()
+                    .filter(('p1_dog', '==', True))
+                    .group_by('p1')
+                    .agg(favorite_count='mean', retweet_count='mean', rating_numerator='mean')
+                    .top(15, 'favorite_count'))
+    name_by_avgs.explain()
+    name_by_avgs.collect()
+
+Nothing is read until collect(). The optimizer then
+
+  * pushes predicates into the storage scan: partition & row-group pruning for
+    read_partitioned(), Arrow filtering for the mapped master, and filters on
+    the group keys placed after group_by() (like .loc[newtop10]) are moved
+    before it, since they only remove whole groups
+  * pushes projections into the scan: only the columns the filters, keys,
+    aggregates & top-k actually use are read, aggregates nobody selects are dropped
+  * applies top-k early: for a top-k on a grouped aggregate the ranking
+    aggregate is computed first from 2 columns, then the remaining aggregates
+    only for the rows of the k winning groups (a second, filtered scan); a
+    top-k without grouping keeps k rows per chunk and reads the newest
+    partitions first when ranking on the time or id column
+
+Filters are (column, op, value) tuples, see partitioned_master.filter_mask.
+After collect(), query.stats has the columns & rows that were read.
+"""
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow as pa
+
+from partitioned_master import MASTER_ROOT, arrow_filter, filter_mask, iter_partitioned
+from shared_master import MASTER_DIR, MasterReader
+
+Filter = namedtuple('Filter', ['predicates'])
+Select = namedtuple('Select', ['columns'])
+Group = namedtuple('Group', ['keys', 'aggs'])            # aggs: {output: (column, func)}
+TopK = namedtuple('TopK', ['k', 'by', 'ascending'])
+
+
+# Storage
+
+class FrameSource(object):
+    """A DataFrame already in memory."""
+
+    def __init__(self, df):
+        self.df = df
+
+    def __repr__(self):
+        return 'FrameSource({} rows)'.format(len(self.df))
+
+    def chunks(self, columns=None, filters=None, stats=None, order_by=None, skip=None):
+        df = self.df
+        if filters:
+            df = df[filter_mask(df, filters)]
+        df = df[list(columns)] if columns is not None else df
+        _count(stats, df)
+        yield df
+
+
+class PartitionedSource(object):
+    """The year/month partitioned master (partitioned_master.py), read one file at a time."""
+
+    def __init__(self, root=MASTER_ROOT, time_col='timestamp', id_col='tweet_id'):
+        self.root, self.time_col, self.id_col = root, time_col, id_col
+
+    def __repr__(self):
+        return 'PartitionedSource({!r})'.format(self.root)
+
+    def chunks(self, columns=None, filters=None, stats=None, order_by=None, skip=None):
+        """
+        order_by - the time or id column: newest partitions first
+        skip     - called with each partition's _stats.json entry before it's read, True skips it
+        """
+        filters = [(col, op, _utc(value) if col == self.time_col else value) for col, op, value in filters or ()]
+        # time & id bounds also prune whole partitions on _stats.json, the filters themselves stay exact
+        start = _bound(filters, self.time_col, ('>=', '>', '=='), max)
+        end = _bound(filters, self.time_col, ('<=', '<', '=='), min)
+        low = _bound(filters, self.id_col, ('>=', '>', '=='), max)
+        high = _bound(filters, self.id_col, ('<=', '<', '=='), min)
+        id_range = None
+        if low is not None or high is not None:
+            id_range = (low if low is not None else -2 ** 63, high if high is not None else 2 ** 63 - 1)
+        newest_first = order_by in (self.time_col, self.id_col)
+        for _, df in iter_partitioned(self.root, start, end, id_range, columns, self.time_col, self.id_col, filters,
+                                      newest_first, skip):
+            _count(stats, df)
+            yield df
+
+    def max_of(self, info, col):
+        """Largest value of col in a partition by its _stats.json entry, None if unknown."""
+        if col == self.time_col:
+            return _utc(info['max_time'])
+        if col == self.id_col:
+            return info['max_id']
+        return None
+
+
+class SharedSource(object):
+    """The memory-mapped master build (shared_master.py), filtered & projected in Arrow."""
+
+    def __init__(self, root=MASTER_DIR):
+        self.reader = MasterReader(root)
+
+    def __repr__(self):
+        return 'SharedSource({})'.format(self.reader.name)
+
+    def chunks(self, columns=None, filters=None, stats=None, order_by=None, skip=None):
+        self.reader.refresh()
+        table = self.reader.table
+        if filters:
+            # Arrow doesn't compare timestamp columns with strings
+            types = dict(zip(table.schema.names, table.schema.types))
+            filters = [(col, op, _utc(value) if pa.types.is_timestamp(types.get(col)) else value)
+                       for col, op, value in filters]
+            table = table.filter(arrow_filter(filters))
+        if columns is not None:
+            table = table.select(list(columns))
+        df = table.to_pandas()
+        _count(stats, df)
+        yield df
+
+
+def _utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def _bound(filters, col, ops, pick):
+    values = [value for c, op, value in filters if c == col and op in ops]
+    return pick(values) if values else None
+
+
+def _count(stats, df):
+    if stats is not None:
+        stats['rows_read'] = stats.get('rows_read', 0) + len(df)
+        stats['columns_read'] = sorted(set(stats.get('columns_read', [])) | set(df.columns))
+        stats['scans'] = stats.get('scans', 0) + 1
+
+
+# Plans
+
+def _columns_of(predicates):
+    return {col for col, _, _ in predicates}
+
+
+class Query(object):
+    """Immutable, every method returns a new Query with one more step."""
+
+    def __init__(self, source, steps=()):
+        self.source = source
+        self.steps = tuple(steps)
+        self.stats = {}
+
+    @classmethod
+    def frame(cls, df):
+        return cls(FrameSource(df))
+
+    @classmethod
+    def partitioned(cls, root=MASTER_ROOT, **kwargs):
+        return cls(PartitionedSource(root, **kwargs))
+
+    @classmethod
+    def shared(cls, root=MASTER_DIR):
+        return cls(SharedSource(root))
+
+    def _then(self, step):
+        return Query(self.source, self.steps + (step,))
+
+    def filter(self, *predicates):
+        """Keep rows (or, after group_by, groups) matching all (column, op, value) predicates."""
+        return self._then(Filter(tuple(predicates)))
+
+    def select(self, *columns):
+        return self._then(Select(tuple(columns)))
+
+    def group_by(self, *keys):
+        """Start a grouping, finished by agg()."""
+        return _Grouping(self, keys)
+
+    def top(self, k, by, ascending=False):
+        """The k rows with the largest (ascending: smallest) by."""
+        return self._then(TopK(k, by, ascending))
+
+    def optimize(self):
+        """(scan columns or None for all, scan filters, remaining steps)."""
+        scan_filters, steps = [], []
+        for step in self.steps:
+            if isinstance(step, Filter):
+                # predicate pushdown: row filters nothing row-dropping comes before, and
+                # filters on the group keys right after the grouping, those only drop whole groups
+                blockers = [s for s in steps if isinstance(s, (Group, TopK))]
+                on_keys = (len(blockers) == 1 and isinstance(blockers[0], Group)
+                           and _columns_of(step.predicates) <= set(blockers[0].keys))
+                if not blockers or on_keys:
+                    scan_filters.extend(step.predicates)
+                    continue
+            steps.append(step)
+
+        # projection pushdown, backwards from the result
+        needed = None
+        for i in range(len(steps) - 1, -1, -1):
+            step = steps[i]
+            if isinstance(step, Select):
+                needed = set(step.columns) if needed is None else needed & set(step.columns)
+            elif isinstance(step, Filter):
+                needed = None if needed is None else needed | _columns_of(step.predicates)
+            elif isinstance(step, TopK):
+                needed = None if needed is None else needed | {step.by}
+            elif isinstance(step, Group):
+                aggs = step.aggs
+                if needed is not None:
+                    # aggregates nothing downstream uses aren't computed
+                    aggs = {out: agg for out, agg in aggs.items() if out in needed}
+                steps[i] = Group(step.keys, aggs)
+                needed = set(step.keys) | {col for col, _ in aggs.values()}
+        columns = None if needed is None else sorted(needed | _columns_of(scan_filters))
+        return columns, scan_filters, steps
+
+    def explain(self):
+        """The optimized plan, one step per line."""
+        columns, filters, steps = self.optimize()
+        lines = ['scan {!r} columns={} filters={}'.format(self.source, columns or 'all', filters or '[]')]
+        for i, step in enumerate(steps):
+            name = type(step).__name__
+            if isinstance(step, Group) and i + 1 < len(steps) and _early_topk(step, steps[i + 1]):
+                name = 'Group (early top-k: rank on {!r}, other aggregates for the top {} groups only)'.format(
+                    steps[i + 1].by, steps[i + 1].k)
+            lines.append('  {} {}'.format(name, tuple(step)))
+        return '\n'.join(lines)
+
+    def collect(self):
+        """Run the optimized plan, returns a DataFrame."""
+        self.stats = {}
+        columns, filters, steps = self.optimize()
+
+        if steps and isinstance(steps[0], TopK):
+            # top-k right on the rows: keep only k per chunk
+            top = steps[0]
+            df = self._topk_rows(columns, filters, top)
+            steps = steps[1:]
+        elif len(steps) > 1 and isinstance(steps[0], Group) and _early_topk(steps[0], steps[1]):
+            df = self._topk_groups(filters, steps[0], steps[1])
+            steps = steps[2:]
+        else:
+            df = _concat(self.source.chunks(columns, filters, self.stats), columns)
+
+        for step in steps:
+            df = _apply(df, step)
+        return df
+
+    def _topk_rows(self, columns, filters, top):
+        best = None
+        order_by = skip = None
+        if isinstance(self.source, PartitionedSource) and not top.ascending:
+            order_by = top.by
+
+            def skip(info):
+                # a partition whose largest value can't beat the k-th row so far isn't read
+                high = self.source.max_of(info, top.by)
+                return best is not None and len(best) >= top.k and high is not None and high < best[top.by].iloc[-1]
+
+        for chunk in self.source.chunks(columns, filters, self.stats, order_by, skip):
+            best = _apply(pd.concat([best, chunk]) if best is not None else chunk, top)
+        return best if best is not None else pd.DataFrame(columns=columns)
+
+    def _topk_groups(self, filters, group, top):
+        keys = list(group.keys)
+        rank_col, func = group.aggs[top.by]
+        # pass 1: keys & the ranking column only
+        ranked = _concat(self.source.chunks(keys + [rank_col], filters, self.stats), keys + [rank_col])
+        ranked = _apply(ranked, Group(group.keys, {top.by: (rank_col, func)}))
+        ranked = _apply(ranked, top)
+        # pass 2: the other aggregates, only for the rows of the winning groups
+        rest = {out: agg for out, agg in group.aggs.items() if out != top.by}
+        if rest:
+            winners = list(ranked.index)
+            others = [col for col, _ in rest.values()]
+            key_filter = [(keys[0], 'in', winners)] if len(keys) == 1 else []
+            read = sorted(set(keys + others))
+            rows = _concat(self.source.chunks(read, filters + key_filter, self.stats), read)
+            if len(keys) > 1:
+                rows = rows[pd.MultiIndex.from_frame(rows[keys]).isin(winners)]
+            ranked = ranked.join(_apply(rows, Group(group.keys, rest)))
+        return ranked[list(group.aggs)]
+
+
+class _Grouping(object):
+    def __init__(self, query, keys):
+        self.query, self.keys = query, tuple(keys)
+
+    def agg(self, **aggs):
+        """output=func (output is also the input column) or output=(column, func), e.g. mean, sum, size."""
+        named = {out: (agg if isinstance(agg, tuple) else (out, agg)) for out, agg in aggs.items()}
+        return self.query._then(Group(self.keys, named))
+
+
+def _early_topk(group, step):
+    return isinstance(step, TopK) and step.by in group.aggs
+
+
+def _concat(chunks, columns=None):
+    frames = list(chunks)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _apply(df, step):
+    if isinstance(step, Filter):
+        # the group keys are the index after a grouping
+        view = df.reset_index() if _columns_of(step.predicates) - set(df.columns) else df
+        return df[filter_mask(view, step.predicates).values]
+    if isinstance(step, Select):
+        return df[list(step.columns)]
+    if isinstance(step, TopK):
+        if not len(df):
+            return df
+        if step.ascending:
+            return df.nsmallest(step.k, step.by, keep='first')
+        return df.nlargest(step.k, step.by, keep='first')
+    if isinstance(step, Group):
+        grouped = df.groupby(list(step.keys), observed=True)
+        return grouped.agg(**{out: pd.NamedAgg(col, func) for out, (col, func) in step.aggs.items()})
+    raise TypeError(step)
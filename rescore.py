@@ -0,0 +1,142 @@
+"""
+Re-score the cached tweet images with a local image classifier.
+
+The p1/p2/p3 columns of image-predictions.tsv are a frozen 2017 artifact.
+rescore() runs any model with the ImageModel interface over the images in
+the image cache (see image_cache.py) on CPU, in batches, and writes rows in
+the same schema as image_preds, so the merge & groupby('p1') analysis work
+unchanged on the new file.
+
+Results are appended batch by batch; re-running only scores the tweets that
+are not in the output file yet.
+
+    model = TorchvisionModel('resnet50')
+    scored, stats = rescore(image_preds, cache_paths(image_preds.jpg_url), model)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from timeit import default_timer as timer
+
+RESCORED_PATH = 'data/image-predictions-rescored.tsv'
+
+PRED_COLS = ['tweet_id', 'jpg_url', 'img_num',
+             'p1', 'p1_conf', 'p1_dog',
+             'p2', 'p2_conf', 'p2_dog',
+             'p3', 'p3_conf', 'p3_dog']
+
+# ImageNet class indices 151 - 268 are the dog breeds
+IMAGENET_DOGS = range(151, 269)
+
+
+class ImageModel(object):
+    """
+    Interface for a swappable classifier.
+
+    labels     - class names, breed names use '_' instead of spaces like image_preds
+    dog_labels - set of the labels that are dogs
+    size       - (width, height) images are resized to
+    predict    - float array (n, height, width, 3) in 0-1 -> probabilities (n, len(labels))
+    """
+    labels = []
+    dog_labels = set()
+    size = (224, 224)
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+
+class TorchvisionModel(ImageModel):
+    """ImageNet classifier from torchvision, e.g. 'resnet50' or 'mobilenet_v3_large'."""
+
+    def __init__(self, name='resnet50', threads=None):
+        import torch
+        import torchvision
+
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        weights = torchvision.models.get_model_weights(name).DEFAULT
+        self.model = torchvision.models.get_model(name, weights=weights).eval()
+        self.labels = [label.replace(' ', '_') for label in weights.meta['categories']]
+        self.dog_labels = {self.labels[i] for i in IMAGENET_DOGS}
+        self.mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+        self.std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    def predict(self, batch):
+        batch = ((batch - self.mean) / self.std).transpose(0, 3, 1, 2)
+        with self.torch.no_grad():
+            logits = self.model(self.torch.from_numpy(np.ascontiguousarray(batch, dtype=np.float32)))
+            return self.torch.softmax(logits, dim=1).numpy()
+
+
+def load_image(path, size):
+    """Read & resize one image to a float32 (height, width, 3) array in 0-1."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img = img.convert('RGB').resize(size)
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def top3(probs, labels, dog_labels):
+    """p1..p3 columns for a batch of probabilities, without sorting every class."""
+    best = np.argpartition(-probs, 3, axis=1)[:, :3]
+    order = np.argsort(-np.take_along_axis(probs, best, axis=1), axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    labels = np.asarray(labels, dtype=object)
+
+    cols = {}
+    for k in range(3):
+        names = labels[best[:, k]]
+        cols['p{}'.format(k + 1)] = names
+        cols['p{}_conf'.format(k + 1)] = probs[np.arange(len(probs)), best[:, k]]
+        cols['p{}_dog'.format(k + 1)] = [name in dog_labels for name in names]
+    return cols
+
+
+def load_scored(out_path=RESCORED_PATH):
+    if os.path.exists(out_path):
+        return pd.read_csv(out_path, sep='\t')
+    return pd.DataFrame(columns=PRED_COLS)
+
+
+def rescore(image_preds, paths, model, out_path=RESCORED_PATH, batch_size=32, threads=4):
+    """
+    Score every image of image_preds that isn't in out_path yet.
+
+    paths   - cached image file per row of image_preds (NaN rows are skipped)
+    threads - threads used to decode & resize images while the model runs
+    Returns (the full scored table, previous runs included, stats). stats has
+    scored (images this run), seconds & images_per_sec.
+    """
+    scored = load_scored(out_path)
+    todo = image_preds.assign(path=np.asarray(paths, dtype=object))
+    todo = todo[todo.path.notnull() & ~todo.tweet_id.isin(scored.tweet_id)]
+
+    start, n_done = timer(), 0
+    header = not os.path.exists(out_path)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for first in range(0, len(todo), batch_size):
+            chunk = todo.iloc[first:first + batch_size]
+            batch = np.stack(list(pool.map(partial(load_image, size=model.size), chunk.path)))
+            result = pd.DataFrame({'tweet_id': chunk.tweet_id.values,
+                                   'jpg_url': chunk.jpg_url.values,
+                                   'img_num': chunk.img_num.values})
+            for col, values in top3(model.predict(batch), model.labels, model.dog_labels).items():
+                result[col] = values
+            # append each batch so an interrupted run picks up where it stopped
+            result[PRED_COLS].to_csv(out_path, sep='\t', index=False, mode='a', header=header)
+            header = False
+            n_done += len(chunk)
+
+    elapsed = timer() - start
+    stats = {
+        'scored': n_done,
+        'seconds': elapsed,
+        'images_per_sec': n_done / elapsed if n_done and elapsed else 0.0,
+    }
+    return load_scored(out_path), stats
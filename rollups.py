@@ -0,0 +1,134 @@
+"""
+Daily, weekly & monthly rollups of tweet volume, ratings, engagement,
+dog stages & top breed, plus rolling-window variants.
+
+Only sums & counts are stored per bucket (and per bucket & breed), so new
+tweets are added onto the stored buckets instead of recomputing history;
+the means & rates are derived from the sums when reading. The tweet_ids
+rolled up so far are stored with them (a sorted int64 array) and skipped,
+so passing the whole master again, or chunks of it in any order, only adds
+the tweets not rolled up yet, late re-fetched old tweets included.
+
+    rollups = update_rollups(new_tweets_df2)
+    rollups['daily']
+    rolling(rollups['daily_sums'], '7D')
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from breed_rank import best_dog
+from dog_stages import STAGES
+
+FREQS = {'daily': 'D', 'weekly': 'W-SUN', 'monthly': 'MS'}
+SUM_COLS = ['tweets', 'rating', 'favorite_count', 'retweet_count'] + STAGES
+ROLLUP_PATH = 'twitter_archive_rollup_{}.csv'
+BREEDS_PATH = 'twitter_archive_rollup_{}_breeds.csv'
+IDS_PATH = 'twitter_archive_rollup_ids.npy'
+
+
+def _prepare(df, time_col):
+    """Numeric columns to sum, on a sorted UTC DatetimeIndex."""
+    out = pd.DataFrame(index=pd.DatetimeIndex(pd.to_datetime(df[time_col], utc=True), name='bucket'))
+    out['tweets'] = 1
+    out['rating'] = (df['rating_numerator'] / df['rating_denominator']).values
+    for col in SUM_COLS[2:]:
+        out[col] = pd.to_numeric(df[col], errors='coerce').values if col in df.columns else np.nan
+    if {'p1', 'p1_conf', 'p1_dog'}.issubset(df.columns):
+        out['breed'] = best_dog(df).breed.values
+    return out.sort_index()
+
+
+def bucket_sums(df, freq, time_col='timestamp'):
+    """(sums, breed counts) of df per bucket of freq."""
+    data = _prepare(df, time_col)
+    sums = data[SUM_COLS].resample(freq).sum(min_count=1)
+    sums['tweets'] = sums['tweets'].fillna(0)
+    if 'breed' in data.columns:
+        breeds = data.dropna(subset=['breed']).groupby([pd.Grouper(freq=freq), 'breed']).size()
+        breeds = breeds.rename('count').reset_index()
+    else:
+        breeds = pd.DataFrame(columns=['bucket', 'breed', 'count'])
+    return sums, breeds
+
+
+def finalize(sums, breeds=None):
+    """Means & rates per bucket from the stored sums."""
+    tweets = sums['tweets'].replace(0, np.nan)
+    out = pd.DataFrame({'tweets': sums['tweets'].astype(int)}, index=sums.index)
+    out['mean_rating'] = sums['rating'] / tweets
+    out['mean_favorites'] = sums['favorite_count'] / tweets
+    out['mean_retweets'] = sums['retweet_count'] / tweets
+    for stage in STAGES:
+        out[stage + '_rate'] = sums[stage] / tweets
+    if breeds is not None and len(breeds):
+        # highest count per bucket, ties go to the alphabetically first breed
+        top = breeds.sort_values(['bucket', 'count', 'breed'], ascending=[True, False, True])
+        out['top_breed'] = top.drop_duplicates('bucket').set_index('bucket').breed.reindex(out.index)
+    return out
+
+
+def rolling(daily_sums, window='7D'):
+    """Rolling-window rollup (e.g. '7D', '30D') from the daily sums."""
+    return finalize(daily_sums.rolling(window).sum())
+
+
+def _read_sums(path):
+    sums = pd.read_csv(path, index_col='bucket')
+    sums.index = pd.to_datetime(sums.index, utc=True)
+    return sums
+
+
+def _read_breeds(path):
+    breeds = pd.read_csv(path)
+    breeds['bucket'] = pd.to_datetime(breeds['bucket'], utc=True)
+    return breeds
+
+
+def _read_ids(path):
+    return np.load(path) if os.path.exists(path) else np.empty(0, dtype='int64')
+
+
+def update_rollups(df, out_dir='.', time_col='timestamp', id_col='tweet_id', freqs=FREQS):
+    """
+    Add the tweets of df that aren't rolled up yet (by id_col) to the stored
+    rollups in out_dir & write them back.
+
+    A re-run on the same master adds nothing, a run on a grown master or on
+    another chunk of it only adds the tweets it hasn't seen.
+    Returns a dict with '<name>' (means & rates) and '<name>_sums' per freq.
+    """
+    ids_path = os.path.join(out_dir, IDS_PATH)
+    done = _read_ids(ids_path)
+    df = df.drop_duplicates(subset=id_col)
+    df = df[~np.isin(df[id_col].to_numpy(dtype='int64'), done)]
+
+    result = {}
+    for name, freq in freqs.items():
+        sums_path = os.path.join(out_dir, ROLLUP_PATH.format(name))
+        breeds_path = os.path.join(out_dir, BREEDS_PATH.format(name))
+        sums, breeds = bucket_sums(df, freq, time_col)
+
+        if os.path.exists(sums_path):
+            sums = pd.concat([_read_sums(sums_path), sums]).groupby(level=0).sum(min_count=1)
+            sums = sums.resample(freq).sum(min_count=1)
+            sums['tweets'] = sums['tweets'].fillna(0)
+        if os.path.exists(breeds_path):
+            breeds = pd.concat([_read_breeds(breeds_path), breeds])
+            breeds = breeds.groupby(['bucket', 'breed'], as_index=False)['count'].sum()
+
+        sums.index.name = 'bucket'
+        sums.to_csv(sums_path)
+        breeds.to_csv(breeds_path, index=False)
+
+        result[name + '_sums'] = sums
+        result[name] = finalize(sums, breeds)
+
+    if len(df):
+        ids = np.union1d(done, df[id_col].to_numpy(dtype='int64'))
+        # np.save adds .npy to names without it, the temporary file keeps the suffix
+        tmp = ids_path[:-len('.npy')] + '.tmp.npy'
+        np.save(tmp, ids)
+        os.replace(tmp, ids_path)
+    return result
@@ -0,0 +1,115 @@
+"""
+Publish the master dataset as a memory-mappable Arrow IPC file.
+
+Workers that each pd.read_csv('twitter_archive_master.csv') hold one parsed
+copy per process. Instead the pipeline publishes master/master-<version>.arrow
+(uncompressed, so it can be mapped as is) and readers memory-map it: there is
+nothing to parse and all readers share the same page-cache pages.
+
+master/CURRENT names the file of the latest build; it is replaced atomically
+(os.replace), so a reader sees either the old or the new build, never half of one.
+
+    publish_master(new_tweets_df2)              # pipeline, nightly
+    reader = MasterReader()                     # worker
+    df = reader.frame()
+    reader.refresh()                            # switch to a newer build, if any
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+MASTER_DIR = 'master'
+POINTER = 'CURRENT'
+
+
+def arrow_safe(df):
+    """Nested objects (e.g. user dicts) can't be mapped as is, store them as JSON strings."""
+    out = df
+    for col in df.columns:
+        if df[col].dtype == object and not df[col].map(lambda v: v is None or isinstance(v, str), na_action='ignore').all():
+            if out is df:
+                out = df.copy()
+            out[col] = df[col].map(json.dumps, na_action='ignore')
+    return out
+
+
+def publish_master(df, root=MASTER_DIR, version=None, keep=3):
+    """
+    Write df as a new version & point CURRENT at it. Returns the version.
+
+    keep - number of versions left on disk, older ones are removed (readers that
+           still map one keep working, the file is only unlinked)
+    """
+    version = version or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(root, exist_ok=True)
+    name = 'master-{}.arrow'.format(version)
+    path = os.path.join(root, name)
+
+    table = pa.Table.from_pandas(arrow_safe(df), preserve_index=False)
+    tmp = path + '.tmp'
+    with pa.OSFile(tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+    # swap the pointer last, readers only ever see finished files
+    pointer_tmp = os.path.join(root, POINTER + '.tmp')
+    with open(pointer_tmp, 'w') as outfile:
+        outfile.write(name)
+    os.replace(pointer_tmp, os.path.join(root, POINTER))
+
+    for old in versions(root)[:-keep] if keep else []:
+        os.remove(os.path.join(root, 'master-{}.arrow'.format(old)))
+    return version
+
+
+def versions(root=MASTER_DIR):
+    """Published versions, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    names = [name for name in os.listdir(root) if name.startswith('master-') and name.endswith('.arrow')]
+    return sorted(name[len('master-'):-len('.arrow')] for name in names)
+
+
+def current(root=MASTER_DIR):
+    """File name CURRENT points at."""
+    with open(os.path.join(root, POINTER)) as infile:
+        return infile.read().strip()
+
+
+def open_master(root=MASTER_DIR, name=None):
+    """Memory-map a published file (default: CURRENT) and return its Arrow Table, zero copy."""
+    name = name or current(root)
+    source = pa.memory_map(os.path.join(root, name), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+class MasterReader(object):
+    """Read-only view of the current master build for a worker process."""
+
+    def __init__(self, root=MASTER_DIR):
+        self.root = root
+        self.name = None
+        self.table = None
+        self.refresh()
+
+    @property
+    def version(self):
+        return self.name[len('master-'):-len('.arrow')] if self.name else None
+
+    def refresh(self):
+        """Switch to the build CURRENT points at. Returns True if it changed."""
+        name = current(self.root)
+        if name == self.name:
+            return False
+        self.table = open_master(self.root, name)
+        self.name = name
+        return True
+
+    def frame(self, columns=None):
+        """DataFrame of Arrow-backed columns over the mapped file (no copy)."""
+        table = self.table.select(columns) if columns else self.table
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
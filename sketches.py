@@ -0,0 +1,359 @@
+"""
+Constant memory, mergeable sketches of the name, breed & engagement columns.
+
+value_counts() & quantile() need the whole column in memory. The sketches
+here are updated one chunk at a time, can be merged across workers & days
+(merging two sketches gives the sketch of both inputs) and are saved as a
+small json file for the dashboards:
+
+    HyperLogLog   - distinct count, ~1% error with the default 2**14 registers
+    CountMin      - frequency of any value, never under the true count
+    SpaceSaving   - top-k most frequent values with their error bounds
+    TDigest       - quantiles, most accurate in the tails
+
+TweetSketches bundles them for the master columns:
+
+    sketches = TweetSketches.load()              # empty if no file yet
+    sketches.update(new_tweets_df2)              # only tweets newer than the max_id saved before
+    sketches.save()
+    sketches.summary()
+
+Values are hashed with pandas' hash_array, which is the same in every process.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from breed_rank import best_dog
+
+SKETCH_PATH = 'twitter_archive_sketches.json'
+COUNT_COLS = ['name', 'breed']
+QUANTILE_COLS = ['favorite_count', 'retweet_count']
+
+
+def hash64(values):
+    """uint64 hash of every value."""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def _bit_length(x):
+    """Number of bits needed for each uint64 of x (0 for 0)."""
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = (x >> np.uint64(shift)) > 0
+        length += big * shift
+        x = np.where(big, x >> np.uint64(shift), x)
+    return length + (x > 0)
+
+
+class HyperLogLog(object):
+    """Distinct count estimate; standard error ~ 1.04 / sqrt(2**p)."""
+
+    def __init__(self, p=14, registers=None):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8) if registers is None else np.asarray(registers, dtype=np.uint8)
+
+    def update(self, values):
+        h = hash64(values)
+        index = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64(2 ** (64 - self.p) - 1)
+        # position of the first 1 bit in the remaining 64 - p bits
+        rank = (64 - self.p - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError('can only merge HyperLogLogs with the same p')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'p': self.p, 'registers': self.registers.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['p'], data['registers'])
+
+
+class CountMin(object):
+    """Frequency estimates: count <= estimate <= count + e/width * total, w.p. 1 - exp(-depth)."""
+
+    def __init__(self, width=2048, depth=5, table=None):
+        self.width, self.depth = width, depth
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else np.asarray(table, dtype=np.int64)
+
+    def _columns(self, values):
+        # depth hash functions from the two halves of one 64 bit hash
+        h = hash64(values)
+        low, high = h & np.uint64(0xFFFFFFFF), h >> np.uint64(32)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((low[None, :] + rows * high[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def update(self, values, counts=None):
+        columns = self._columns(values)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(columns[row], weights=counts, minlength=self.width).astype(np.int64)
+        return self
+
+    def merge(self, other):
+        if other.table.shape != self.table.shape:
+            raise ValueError('can only merge CountMins of the same width & depth')
+        self.table += other.table
+        return self
+
+    def estimate(self, values):
+        columns = self._columns(values)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    @property
+    def total(self):
+        return int(self.table[0].sum())
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'table': self.table.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['width'], data['depth'], data['table'])
+
+
+class SpaceSaving(object):
+    """
+    Top-k candidates holding at most k counters.
+
+    counts over-estimate by at most error; any value not kept occurred at most
+    floor() times, so every value with a true count above floor() is kept.
+    """
+
+    def __init__(self, k=100, counts=None, errors=None):
+        self.k = k
+        self.counts = pd.Series(counts or {}, dtype=np.int64)
+        self.errors = pd.Series(errors or {}, dtype=np.int64).reindex(self.counts.index, fill_value=0)
+
+    def floor(self):
+        """Upper bound of the count of any value that isn't kept."""
+        return int(self.counts.min()) if len(self.counts) >= self.k else 0
+
+    def _combine(self, counts, errors, floor):
+        index = self.counts.index.union(counts.index)
+        mine, theirs = self.floor(), floor
+        total = self.counts.reindex(index, fill_value=mine) + counts.reindex(index, fill_value=theirs)
+        error = self.errors.reindex(index, fill_value=mine) + errors.reindex(index, fill_value=theirs)
+        keep = total.nlargest(self.k, keep='first').index
+        self.counts, self.errors = total[keep], error[keep]
+
+    def update(self, values):
+        # exact counts of the chunk, combined like a summary without error
+        counts = pd.Series(values).dropna().value_counts()
+        self._combine(counts, pd.Series(0, index=counts.index, dtype=np.int64), 0)
+        return self
+
+    def merge(self, other):
+        self._combine(other.counts, other.errors, other.floor())
+        return self
+
+    def top(self, n=10):
+        """The n largest counters: count (upper bound) & error (count - error is a lower bound)."""
+        top = self.counts.nlargest(n, keep='first')
+        return pd.DataFrame({'count': top, 'error': self.errors[top.index]})
+
+    def to_dict(self):
+        return {'k': self.k, 'counts': {str(key): int(v) for key, v in self.counts.items()},
+                'errors': {str(key): int(v) for key, v in self.errors.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['k'], data['counts'], data['errors'])
+
+
+class TDigest(object):
+    """
+    Quantile sketch of at most ~compression centroids (merging t-digest, k1 scale).
+    Compression is vectorized: centroids falling in the same unit of the scale
+    function are summed with np.add.reduceat.
+    """
+
+    def __init__(self, compression=100, means=None, weights=None, min=np.inf, max=-np.inf):
+        self.compression = compression
+        self.means = np.asarray(means if means is not None else [], dtype=float)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=float)
+        self.min, self.max = min, max
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        left = (np.cumsum(weights) - weights) / total
+        # k1 scale: units are narrow near q = 0 & 1, so the tails keep more centroids
+        k = self.compression / np.pi * np.arcsin(2 * left - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other):
+        if len(other.weights):
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+        return self
+
+    @property
+    def count(self):
+        return int(self.weights.sum())
+
+    def quantile(self, q):
+        """Approximate quantile(s) q in [0, 1], NaN while empty."""
+        q = np.asarray(q, dtype=float)
+        if not len(self.weights):
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        # interpolate between the centroid centers, pinned to min & max at the ends
+        centers = (np.cumsum(self.weights) - self.weights / 2) / self.weights.sum()
+        xs = np.concatenate([[0.0], centers, [1.0]])
+        ys = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(q, xs, ys)
+
+    def to_dict(self):
+        return {'compression': self.compression, 'means': self.means.tolist(), 'weights': self.weights.tolist(),
+                'min': None if np.isinf(self.min) else float(self.min),
+                'max': None if np.isinf(self.max) else float(self.max)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['compression'], data['means'], data['weights'],
+                   np.inf if data['min'] is None else data['min'], -np.inf if data['max'] is None else data['max'])
+
+
+class TweetSketches(object):
+    """Distinct & top names / breeds and favorite / retweet quantiles of all tweets seen."""
+
+    def __init__(self, count_cols=COUNT_COLS, quantile_cols=QUANTILE_COLS):
+        self.distinct = {col: HyperLogLog() for col in count_cols}
+        self.freqs = {col: CountMin() for col in count_cols}
+        self.top_k = {col: SpaceSaving() for col in count_cols}
+        self.quantiles = {col: TDigest() for col in quantile_cols}
+        self.rows = 0
+        # largest tweet id added (tweet ids grow with time) & the one saved last:
+        # rows at or below saved_id are in the file already, max_id is only saved by save()
+        self.max_id = None
+        self.saved_id = None
+
+    def _column(self, df, col):
+        if col == 'breed' and col not in df.columns and 'p1_dog' in df.columns:
+            values = best_dog(df).breed
+        elif col in df.columns:
+            values = df[col]
+        else:
+            return None
+        values = values.dropna()
+        # the archive uses 'None' (and a few lowercase words, see Q2) for missing names
+        return values[values != 'None'].astype(str).values if col == 'name' else values.values
+
+    def update(self, df, id_col='tweet_id'):
+        """
+        Add one chunk of master rows, in any id order. Rows at or below the
+        max_id of the last save() / load() are already in the sketches & skipped,
+        so updating with the whole master again after a load is a no-op.
+        """
+        if id_col in df.columns:
+            if self.saved_id is not None:
+                df = df[df[id_col] > self.saved_id]
+            if len(df):
+                self.max_id = max(int(df[id_col].max()), self.max_id or 0)
+        for col in self.distinct:
+            values = self._column(df, col)
+            if values is None or not len(values):
+                continue
+            self.distinct[col].update(values)
+            self.top_k[col].update(values)
+            # count-min takes each distinct value of the chunk once, with its count
+            counts = pd.Series(values).value_counts()
+            self.freqs[col].update(counts.index.values, counts.values)
+        for col, digest in self.quantiles.items():
+            if col in df.columns:
+                digest.update(pd.to_numeric(df[col], errors='coerce').values)
+        self.rows += len(df)
+        return self
+
+    def merge(self, other):
+        for attr in ('distinct', 'freqs', 'top_k', 'quantiles'):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            for col in mine.keys() & theirs.keys():
+                mine[col].merge(theirs[col])
+        self.rows += other.rows
+        if other.max_id is not None:
+            self.max_id = max(other.max_id, self.max_id or 0)
+        return self
+
+    def frequency(self, col, values):
+        """Estimated counts of values in col, as a Series."""
+        values = list(values)
+        return pd.Series(self.freqs[col].estimate(values), index=values, name=col)
+
+    def summary(self, n=10, quantiles=(0.5, 0.9, 0.99)):
+        """Approximate answers: distinct counts, top n values & quantiles."""
+        return {
+            'rows': self.rows,
+            'distinct': {col: sketch.count() for col, sketch in self.distinct.items()},
+            'top': {col: sketch.top(n) for col, sketch in self.top_k.items()},
+            'quantiles': pd.DataFrame({col: digest.quantile(list(quantiles)) for col, digest in self.quantiles.items()},
+                                      index=list(quantiles)),
+        }
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'max_id': self.max_id,
+            'distinct': {col: s.to_dict() for col, s in self.distinct.items()},
+            'freqs': {col: s.to_dict() for col, s in self.freqs.items()},
+            'top_k': {col: s.to_dict() for col, s in self.top_k.items()},
+            'quantiles': {col: s.to_dict() for col, s in self.quantiles.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls(list(data['distinct']), list(data['quantiles']))
+        sketches.rows = data['rows']
+        sketches.max_id = sketches.saved_id = data.get('max_id')
+        sketches.distinct = {col: HyperLogLog.from_dict(d) for col, d in data['distinct'].items()}
+        sketches.freqs = {col: CountMin.from_dict(d) for col, d in data['freqs'].items()}
+        sketches.top_k = {col: SpaceSaving.from_dict(d) for col, d in data['top_k'].items()}
+        sketches.quantiles = {col: TDigest.from_dict(d) for col, d in data['quantiles'].items()}
+        return sketches
+
+    def save(self, path=SKETCH_PATH):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as outfile:
+            json.dump(self.to_dict(), outfile)
+        os.replace(tmp, path)
+        self.saved_id = self.max_id
+
+    @classmethod
+    def load(cls, path=SKETCH_PATH):
+        """Saved sketches, or empty ones if path doesn't exist yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as infile:
+            return cls.from_dict(json.load(infile))
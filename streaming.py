@@ -0,0 +1,232 @@
+"""
+Streaming ingest: new tweets as events instead of one batch run.
+
+A source is any iterable of event dicts (rows like twitter-archive-enhanced.csv)
+and may yield None while it has nothing new, so a half full micro-batch can
+still be flushed on time. Included sources:
+
+    replay(df, rate)           - rows of a DataFrame, e.g. the archive, as a local test stream
+    tail_file(path)            - JSON lines appended to a file
+    socket_lines(host, port)   - JSON lines from a local TCP socket
+
+StreamProcessor cuts the events into micro-batches (batch_size events or
+max_delay seconds, whichever comes first), runs the same Q1 - Q5 cleaners as
+the batch pipeline (cleaning.clean_archive), joins the cached image_preds and
+adds the batch onto per-pane sums (rollups.bucket_sums). Tumbling windows are
+the panes themselves, sliding windows are summed from the panes, so only the
+panes of the longest window (plus allowed lateness) are ever kept.
+
+    stream = StreamProcessor(image_preds, pane='1h')
+    stream.run(replay(twitterDF, rate=500))
+    stream.tumbling()              # closed hourly windows: tweets, mean_rating, top_breed, ...
+    stream.sliding('6h')
+    stream.latency()               # end-to-end latency percentiles (ms)
+
+An event's latency is measured from its 'emitted_at' (epoch seconds, set by
+the producer or by the source when missing) to the end of its batch.
+"""
+import json
+import socket
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from cleaning import clean_archive
+from rollups import SUM_COLS, bucket_sums, finalize
+from sketches import TDigest
+
+
+# Sources
+
+def replay(df, rate=None):
+    """Rows of df as events; rate - events per second (None: as fast as possible)."""
+    records = df.to_dict('records')
+    interval = 1.0 / rate if rate else 0
+    start = time.time()
+    for i, record in enumerate(records):
+        if interval:
+            wait = start + i * interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        record['emitted_at'] = time.time()
+        yield record
+
+
+def tail_file(path, poll=0.2, idle_timeout=None):
+    """
+    JSON lines appended to path, like tail -f. Yields None after every poll
+    without new lines and stops after idle_timeout seconds without any.
+    """
+    last = time.time()
+    with open(path) as infile:
+        buffer = ''
+        while True:
+            chunk = infile.readline()
+            if chunk:
+                buffer += chunk
+                if buffer.endswith('\n'):
+                    line, buffer = buffer.strip(), ''
+                    if line:
+                        event = json.loads(line)
+                        event.setdefault('emitted_at', time.time())
+                        last = time.time()
+                        yield event
+                continue
+            if idle_timeout is not None and time.time() - last > idle_timeout:
+                return
+            yield None
+            time.sleep(poll)
+
+
+def socket_lines(host='localhost', port=9999, timeout=0.2):
+    """JSON lines read from a TCP connection to host:port, until the peer closes it."""
+    with socket.create_connection((host, port)) as conn:
+        conn.settimeout(timeout)
+        buffer = b''
+        while True:
+            try:
+                data = conn.recv(65536)
+            except socket.timeout:
+                yield None
+                continue
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    event = json.loads(line)
+                    event.setdefault('emitted_at', time.time())
+                    yield event
+
+
+# Processing
+
+class StreamProcessor(object):
+    """
+    Micro-batch cleaning, image_preds join & windowed aggregates of a tweet stream.
+
+    pane         - tumbling window size, also the step of the sliding windows
+    max_window   - longest sliding window that will be asked for, bounds the panes kept
+    lateness     - how far behind the newest event time an event may be before it is dropped
+    keep_closed  - number of closed tumbling windows kept for tumbling()
+    """
+
+    def __init__(self, image_preds=None, pane='1h', max_window='24h', lateness='1h',
+                 batch_size=500, max_delay=1.0, keep_closed=1000, time_col='timestamp'):
+        self.preds = image_preds.drop_duplicates('tweet_id').set_index('tweet_id') if image_preds is not None else None
+        self.pane = pd.Timedelta(pane)
+        self.freq = pd.tseries.frequencies.to_offset(self.pane)
+        self.lateness = pd.Timedelta(lateness)
+        self.retention = pd.Timedelta(max_window) + self.lateness
+        self.batch_size, self.max_delay = batch_size, max_delay
+        self.time_col = time_col
+
+        self.sums = pd.DataFrame(columns=SUM_COLS, dtype=float)
+        self.breeds = pd.DataFrame(columns=['bucket', 'breed', 'count'])
+        self.closed = deque(maxlen=keep_closed)
+        self.watermark = None
+        self.latencies = TDigest()
+        self.counts = {'events': 0, 'batches': 0, 'late': 0, 'retweets': 0}
+
+    def join_preds(self, df):
+        """Left join of the cached image predictions on tweet_id."""
+        if self.preds is None:
+            return df
+        preds = self.preds.reindex(df['tweet_id'].values)
+        preds.index = df.index
+        return pd.concat([df, preds], axis=1)
+
+    def process(self, events):
+        """Clean, join & aggregate one micro-batch of event dicts."""
+        emitted = np.array([event.get('emitted_at', np.nan) for event in events], dtype=float)
+        batch = pd.DataFrame.from_records(events)
+        if 'retweeted_status_id' not in batch.columns:
+            batch['retweeted_status_id'] = np.nan
+        self.counts['events'] += len(batch)
+        self.counts['batches'] += 1
+
+        df = clean_archive(batch)
+        self.counts['retweets'] += len(batch) - len(df)
+        if self.watermark is not None:
+            late = df[self.time_col] < self.watermark - self.lateness
+            self.counts['late'] += int(late.sum())
+            df = df[~late]
+        if len(df):
+            self._add(self.join_preds(df))
+
+        done = time.time()
+        latency = (done - emitted[~np.isnan(emitted)]) * 1000
+        self.latencies.update(latency)
+        return df
+
+    def _add(self, df):
+        sums, breeds = bucket_sums(df, self.freq, self.time_col)
+        sums = sums[sums['tweets'] > 0]
+        self.sums = sums if not len(self.sums) else pd.concat([self.sums, sums]).groupby(level=0).sum(min_count=1)
+        if len(breeds):
+            breeds = pd.concat([self.breeds, breeds]) if len(self.breeds) else breeds
+            self.breeds = breeds.groupby(['bucket', 'breed'], as_index=False)['count'].sum()
+
+        newest = df[self.time_col].max()
+        self.watermark = newest if self.watermark is None else max(self.watermark, newest)
+        self._close()
+
+    def _close(self):
+        """Emit the panes no event can reach anymore & drop those older than any window."""
+        cutoff = self.watermark - self.lateness
+        closed = self.sums[(self.sums.index + self.pane) <= cutoff]
+        if len(closed):
+            emitted = self.closed[-1].name if self.closed else None
+            breeds = self.breeds[self.breeds['bucket'].isin(closed.index)]
+            for bucket, row in finalize(closed, breeds).iterrows():
+                if emitted is None or bucket > emitted:
+                    self.closed.append(row)
+
+        oldest = self.watermark - self.retention
+        self.sums = self.sums[self.sums.index + self.pane > oldest]
+        self.breeds = self.breeds[self.breeds['bucket'] + self.pane > oldest]
+
+    def run(self, source, max_events=None):
+        """Consume source until it ends (or max_events), returns the counts."""
+        buffer, first = [], None
+        for event in source:
+            if event is not None:
+                buffer.append(event)
+                first = first or time.time()
+            full = len(buffer) >= self.batch_size
+            if buffer and (full or time.time() - first >= self.max_delay):
+                self.process(buffer)
+                buffer, first = [], None
+            if max_events is not None and self.counts['events'] + len(buffer) >= max_events:
+                break
+        if buffer:
+            self.process(buffer)
+        return dict(self.counts)
+
+    def tumbling(self):
+        """Closed pane sized windows, oldest first."""
+        return pd.DataFrame(list(self.closed))
+
+    def open_windows(self):
+        """The panes still receiving events, same columns as tumbling()."""
+        return finalize(self.sums, self.breeds)
+
+    def sliding(self, window='6h'):
+        """Windows of length window ending at every pane (must be <= max_window)."""
+        if pd.Timedelta(window) + self.lateness > self.retention:
+            raise ValueError('window is longer than max_window, its panes are not kept')
+        # panes without events are empty windows, not missing ones
+        sums = self.sums.sort_index().asfreq(self.freq, fill_value=0)
+        return finalize(sums.rolling(window, min_periods=1).sum())
+
+    def top_breeds(self, window='6h', k=5):
+        """Most tweeted breeds in the last window of event time."""
+        recent = self.breeds[self.breeds['bucket'] + self.pane > self.watermark - pd.Timedelta(window)]
+        return recent.groupby('breed')['count'].sum().nlargest(k)
+
+    def latency(self, quantiles=(0.5, 0.9, 0.99, 0.999)):
+        """End-to-end event latency percentiles in milliseconds."""
+        return pd.Series(self.latencies.quantile(list(quantiles)), index=list(quantiles), name='latency_ms')
@@ -0,0 +1,135 @@
+"""
+Inverted index over tweet text.
+
+Finding tweets that mention a word with .str.contains scans every row; the
+index maps each token to the tweets (& positions) it occurs in, so term and
+phrase lookups only touch the matching postings.
+
+    index = TweetIndex()
+    index.add_frame(twitterDF, 'text')
+    index.search('floofer')
+    index.phrase('13/10 would pet')
+    index.save('data/text_index.pkl.gz')
+"""
+import gzip
+import pickle
+import re
+from collections import defaultdict
+
+import numpy as np
+
+# order matters: urls before words, ratings before plain numbers
+TOKEN_RE = re.compile(r"""
+    (?P<url>https?://\S+)
+  | (?P<rating>\d+(?:\.\d+)?/\d+)
+  | (?P<hashtag>\#\w+)
+  | (?P<mention>@\w+)
+  | (?P<word>\w+(?:'\w+)?)
+""", re.VERBOSE)
+
+
+def tokenize(text):
+    """Split tweet text into tokens; urls keep their case (t.co paths are case sensitive)."""
+    if not isinstance(text, str):
+        return []
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'url':
+            tokens.append(token.rstrip('.,!?)'))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+
+class TweetIndex(object):
+    """Positional inverted index, tweet_id based."""
+
+    def __init__(self):
+        # term -> {doc number: [positions]}
+        self.postings = defaultdict(dict)
+        self.tweet_ids = []
+        self.indexed = set()
+        self._id_array = None
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    def add(self, tweet_id, text):
+        """Index one tweet, tweets already in the index are skipped."""
+        if tweet_id in self.indexed:
+            return False
+        doc = len(self.tweet_ids)
+        self.tweet_ids.append(tweet_id)
+        self.indexed.add(tweet_id)
+        for pos, token in enumerate(tokenize(text)):
+            self.postings[token].setdefault(doc, []).append(pos)
+        return True
+
+    def add_frame(self, df, text_col='text', id_col='tweet_id'):
+        """Index every row of df, works for 'text' (archive) and 'full_text' (API)."""
+        added = 0
+        for tweet_id, text in zip(df[id_col].values, df[text_col].values):
+            added += self.add(tweet_id, text)
+        return added
+
+    def _docs(self, token):
+        return self.postings.get(token, {})
+
+    def _ids(self, docs):
+        # doc number -> tweet_id lookup array, rebuilt only after new tweets were added
+        if self._id_array is None or len(self._id_array) != len(self.tweet_ids):
+            self._id_array = np.asarray(self.tweet_ids)
+        return self._id_array[np.sort(np.fromiter(docs, dtype=np.int64, count=len(docs)))]
+
+    def search(self, *terms):
+        """tweet_ids containing all terms."""
+        tokens = [token for term in terms for token in tokenize(term)]
+        if not tokens:
+            return np.array([], dtype=np.int64)
+        # intersect starting from the rarest term
+        postings = sorted((self._docs(token) for token in tokens), key=len)
+        docs = set(postings[0])
+        for posting in postings[1:]:
+            docs.intersection_update(posting)
+            if not docs:
+                break
+        return self._ids(docs)
+
+    def phrase(self, text):
+        """tweet_ids containing the tokens of text next to each other, in order."""
+        tokens = tokenize(text)
+        if not tokens:
+            return np.array([], dtype=np.int64)
+        postings = [self._docs(token) for token in tokens]
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+
+        matches = []
+        for doc in candidates:
+            starts = set(postings[0][doc])
+            for offset, posting in enumerate(postings[1:], 1):
+                starts &= {pos - offset for pos in posting[doc]}
+                if not starts:
+                    break
+            if starts:
+                matches.append(doc)
+        return self._ids(matches)
+
+    def save(self, path):
+        """Persist the index (gzip pickle)."""
+        with gzip.open(path, 'wb') as outfile:
+            pickle.dump((dict(self.postings), self.tweet_ids), outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save(); more tweets can be added afterwards."""
+        with gzip.open(path, 'rb') as infile:
+            postings, tweet_ids = pickle.load(infile)
+        index = cls()
+        index.postings.update(postings)
+        index.tweet_ids = tweet_ids
+        index.indexed = set(tweet_ids)
+        return index
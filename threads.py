@@ -0,0 +1,203 @@
+"""
+Reply threads: link replies (in_reply_to_status_id) to their parent tweets.
+
+ThreadIndex keeps the reply edges as int64 arrays over dense node numbers and
+resolves every tweet's root & depth by pointer jumping (each round every node
+jumps to its pointer's pointer, so a chain of length d takes log2(d) rounds of
+vectorized numpy indexing). Tweets of a thread are grouped CSR style: one
+array of node numbers sorted by thread & an offsets array per thread.
+
+Parents that aren't in the data (replies to other accounts' tweets, deleted
+tweets) are kept as nodes, so two replies to the same missing tweet still end
+up in one thread.
+
+    threads = ThreadIndex.from_frame(twitterDF)
+    threads.frame()                  # tweet_id, thread_id, root_id, depth
+    threads.thread(855818117272018944)
+    threads.add_edges(new_ids, new_parent_ids)
+"""
+import numpy as np
+import pandas as pd
+
+MAX_ROUNDS = 64
+
+
+def reply_edges(df, id_col='tweet_id', parent_col='in_reply_to_status_id'):
+    """(child, parent) int64 arrays of the rows that are replies."""
+    replies = df[df[parent_col].notnull()]
+    # the archive stores the parent ids as floats (Q6)
+    return replies[id_col].to_numpy(dtype='int64'), replies[parent_col].astype('int64').to_numpy()
+
+
+class ThreadIndex(object):
+    """Reply forest over tweet ids with root, depth & per-thread lookups."""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype='int64')          # node -> tweet id, sorted
+        self.parent = np.empty(0, dtype='int64')       # node -> parent node, -1 for none
+        self.root = np.empty(0, dtype='int64')         # node -> root node
+        self.depth = np.empty(0, dtype='int64')        # node -> replies between node & root
+        self._members = None
+
+    @classmethod
+    def from_frame(cls, df, id_col='tweet_id', parent_col='in_reply_to_status_id'):
+        index = cls()
+        index.add_nodes(df[id_col].to_numpy(dtype='int64'))
+        index.add_edges(*reply_edges(df, id_col, parent_col))
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nodes(self, tweet_ids):
+        """Node numbers of tweet_ids, -1 for unknown ids."""
+        tweet_ids = np.asarray(tweet_ids, dtype='int64')
+        if not len(self.ids):
+            return np.full(len(tweet_ids), -1, dtype='int64')
+        pos = np.minimum(np.searchsorted(self.ids, tweet_ids), len(self.ids) - 1)
+        return np.where(self.ids[pos] == tweet_ids, pos, -1)
+
+    def add_nodes(self, tweet_ids):
+        """Add tweets (without parents) not in the index yet."""
+        tweet_ids = np.asarray(tweet_ids, dtype='int64')
+        new = _sorted_unique(tweet_ids[self.nodes(tweet_ids) < 0])
+        if not len(new):
+            return
+        ids = np.concatenate([self.ids, new])
+        order = np.argsort(ids, kind='stable')
+        # renumber the existing node references to the merged sort order
+        renumber = np.empty(len(ids), dtype='int64')
+        renumber[order] = np.arange(len(ids))
+        n_old = len(self.ids)
+
+        def remap(values, fill):
+            out = np.concatenate([values, np.full(len(new), fill, dtype='int64')])
+            refs = out >= 0
+            out[refs] = renumber[out[refs]]
+            return out[order]
+
+        self.parent = remap(self.parent, -1)
+        # new nodes are their own roots at depth 0
+        root = np.concatenate([self.root, np.arange(n_old, len(ids))])
+        self.root = renumber[root][order]
+        self.depth = np.concatenate([self.depth, np.zeros(len(new), dtype='int64')])[order]
+        self.ids = ids[order]
+        self._members = None
+
+    def add_edges(self, children, parents):
+        """
+        Add reply edges (child tweet id, parent tweet id) & update roots and depths.
+
+        A tweet only has one parent: edges for children that already have one are
+        ignored. Only the trees that got a new edge above them change, but all
+        roots & depths are brought up to date in the same vectorized rounds.
+        """
+        children = np.asarray(children, dtype='int64')
+        parents = np.asarray(parents, dtype='int64')
+        if not len(children):
+            return
+        # a cycle leaves the index as it was, nodes added for the edges included
+        state = self.ids, self.parent, self.root, self.depth
+        self.add_nodes(np.concatenate([children, parents]))
+        try:
+            self._link(self.nodes(children), self.nodes(parents))
+        except ValueError:
+            self.ids, self.parent, self.root, self.depth = state
+            raise
+        finally:
+            self._members = None
+
+    def _link(self, child, parent):
+        # first edge per child, sorted by child
+        order = np.argsort(child, kind='stable')
+        first = order[_first_of_runs(child[order])]
+        child, parent = child[first], parent[first]
+        keep = (self.parent[child] < 0) & (child != parent)
+        child, parent = child[keep], parent[keep]
+        if not len(child):
+            return
+        # new pointers are built on copies & only stored once they turned out acyclic
+        parents = self.parent.copy()
+        parents[child] = parent
+
+        # every node already points at its (old) root; the children were roots,
+        # so they & their trees now point one step above them, the jumping
+        # below finishes the rest
+        pointer = self.root.copy()
+        dist = self.depth.copy()
+        below = np.isin(self.root, child)
+        dist[below] += 1
+        pointer[below] = parent[np.searchsorted(child, self.root[below])]
+        root, depth = _jump(pointer, dist)
+        if (parents[root] >= 0).any():
+            raise ValueError('reply edges contain a cycle')
+        self.parent, self.root, self.depth = parents, root, depth
+
+    def _build_members(self):
+        # CSR: nodes sorted by root, offsets[r]:offsets[r + 1] are the nodes of root r
+        order = np.lexsort((self.depth, self.root))
+        counts = np.bincount(self.root, minlength=len(self.ids))
+        offsets = np.zeros(len(self.ids) + 1, dtype='int64')
+        np.cumsum(counts, out=offsets[1:])
+        self._members = order, offsets
+
+    def thread(self, tweet_id):
+        """Tweet ids of the thread tweet_id is in, root first, ordered by depth."""
+        node = self.nodes([tweet_id])[0]
+        if node < 0:
+            raise KeyError(tweet_id)
+        if self._members is None:
+            self._build_members()
+        order, offsets = self._members
+        root = self.root[node]
+        return self.ids[order[offsets[root]:offsets[root + 1]]]
+
+    def frame(self, tweet_ids=None):
+        """
+        tweet_id, thread_id, root_id, parent_id & depth per tweet (default all nodes).
+        thread_id numbers the threads, root_id is the tweet that started it.
+        """
+        nodes = np.arange(len(self.ids)) if tweet_ids is None else self.nodes(tweet_ids)
+        known = nodes >= 0
+        nodes = np.where(known, nodes, 0)
+        thread_ids = np.unique(self.root, return_inverse=True)[1].reshape(-1)
+        parent = self.parent[nodes]
+        out = pd.DataFrame({
+            'tweet_id': self.ids[nodes] if tweet_ids is None else np.asarray(tweet_ids, dtype='int64'),
+            'thread_id': pd.array(np.where(known, thread_ids[nodes], 0), dtype='Int64'),
+            'root_id': pd.array(self.ids[self.root[nodes]], dtype='Int64'),
+            'parent_id': pd.array(np.where(parent >= 0, self.ids[parent], 0), dtype='Int64'),
+            'depth': pd.array(self.depth[nodes], dtype='Int64'),
+        })
+        out.loc[parent < 0, 'parent_id'] = pd.NA
+        out.loc[~known, ['thread_id', 'root_id', 'parent_id', 'depth']] = pd.NA
+        return out
+
+    def thread_sizes(self):
+        """Number of tweets per root tweet id, largest threads first."""
+        counts = np.bincount(self.root, minlength=len(self.ids))
+        roots = np.flatnonzero(counts)
+        return pd.Series(counts[roots], index=pd.Index(self.ids[roots], name='root_id'),
+                         name='tweets').sort_values(ascending=False)
+
+
+def _first_of_runs(values):
+    """Mask of the first element of each run of equal values."""
+    return np.concatenate([[True], values[1:] != values[:-1]]) if len(values) else np.zeros(0, dtype=bool)
+
+
+def _sorted_unique(values):
+    # sort based, np.unique's hashing is slower on millions of int64 ids
+    values = np.sort(values)
+    return values[_first_of_runs(values)]
+
+
+def _jump(pointer, dist):
+    """Follow pointer to its end for every node, summing dist on the way."""
+    for _ in range(MAX_ROUNDS):
+        nxt = pointer[pointer]
+        if np.array_equal(nxt, pointer):
+            return pointer, dist
+        dist = dist + dist[pointer]
+        pointer = nxt
+    raise ValueError('reply edges contain a cycle')
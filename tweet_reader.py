@@ -0,0 +1,88 @@
+"""
+Read many compressed tweet JSONL shards in parallel.
+
+The archived fetches are stored as gzip / zstd (/ bz2 / xz) compressed
+JSONL shards. read_tweets() decompresses & parses every shard in its own
+worker process and merges the results in tweet id order, so the time to get
+a DataFrame scales with the cores instead of being one read_json call.
+
+    rt_tweets, stats = read_tweets('data/tweets/*.jsonl.zst')
+    stats['mb_per_sec_per_core']
+
+zstd shards need the zstandard package.
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from timeit import default_timer as timer
+
+import pandas as pd
+
+
+def _open_zstd(path, mode='rb'):
+    import zstandard
+
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.zst': _open_zstd,
+}
+
+
+def read_shard(path):
+    """Decompress & parse one shard, returns (DataFrame, uncompressed bytes, seconds)."""
+    start = timer()
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as infile:
+        raw = infile.read()
+    # dtype=False keeps ids as int64, read_json would otherwise try float conversions
+    df = pd.read_json(io.BytesIO(raw), lines=True, dtype=False) if raw.strip() else pd.DataFrame()
+    return df, len(raw), timer() - start
+
+
+def read_tweets(shards, processes=None, id_col='id', latest_wins=True):
+    """
+    Read all shards (a glob pattern or list of paths) in a process pool.
+
+    Returns (DataFrame sorted by id_col, stats). With latest_wins, a tweet found
+    in several shards is kept from the most recently modified shard.
+    stats has shards, rows, mb (uncompressed), seconds (wall) & mb_per_sec_per_core.
+    """
+    paths = sorted(glob(shards)) if isinstance(shards, str) else list(shards)
+    # oldest first, so later (newer) rows win in drop_duplicates(keep='last')
+    paths = sorted(paths, key=os.path.getmtime)
+
+    start = timer()
+    frames, n_bytes, busy = [], 0, 0.0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for df, size, seconds in pool.map(read_shard, paths):
+            frames.append(df)
+            n_bytes += size
+            busy += seconds
+
+    frames = [df for df in frames if len(df)]
+    tweets = pd.concat(frames, ignore_index=True, sort=False) if frames else pd.DataFrame()
+    if len(tweets):
+        if latest_wins:
+            tweets = tweets.drop_duplicates(subset=id_col, keep='last')
+        tweets = tweets.sort_values(id_col, kind='stable').reset_index(drop=True)
+    elapsed = timer() - start
+
+    stats = {
+        'shards': len(paths),
+        'rows': len(tweets),
+        'mb': n_bytes / 1e6,
+        'seconds': elapsed,
+        'mb_per_sec': n_bytes / 1e6 / elapsed if elapsed else 0.0,
+        # throughput of a single worker while it was busy
+        'mb_per_sec_per_core': n_bytes / 1e6 / busy if busy else 0.0,
+    }
+    return tweets, stats
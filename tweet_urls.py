@@ -0,0 +1,77 @@
+"""
+Split expanded_urls into one row per url & classify the tweet media.
+
+expanded_urls is a comma joined string of urls, e.g. a tweet with 2 photos
+has '.../status/<id>/photo/1' twice. explode_urls() turns it into a
+(tweet_id, url, kind, position) table with vectorized string operations and
+url_counts() derives n_photos, has_vine, ... per tweet from that table.
+"""
+import numpy as np
+import pandas as pd
+from timeit import default_timer as timer
+
+# (kind, regex on the normalized url), first match wins
+KINDS = [
+    ('photo', r'twitter\.com/.+/photo/'),
+    ('video', r'twitter\.com/.+/video/'),
+    ('vine', r'vine\.co/'),
+    ('gofundme', r'gofundme\.com/'),
+    ('instagram', r'instagram\.com/'),
+    ('youtube', r'youtube\.com/|youtu\.be/'),
+    ('tweet', r'twitter\.com/.+/status/'),
+]
+OTHER = 'other'
+
+
+def normalize(urls):
+    """Strip whitespace, use https:// without www. / mobile. & drop a trailing '/'."""
+    urls = urls.str.strip()
+    urls = urls.str.replace(r'^(?:https?://)?(?:www\.|mobile\.|m\.)?', 'https://', regex=True, case=False)
+    return urls.str.rstrip('/').where(urls.str.len() > len('https://'))
+
+
+def classify(urls):
+    """Kind of each normalized url, see KINDS."""
+    conditions = [urls.str.contains(pattern, regex=True, case=False, na=False).to_numpy(dtype=bool) for _, pattern in KINDS]
+    return pd.Series(np.select(conditions, [kind for kind, _ in KINDS], default=OTHER), index=urls.index)
+
+
+def explode_urls(df, id_col='tweet_id', url_col='expanded_urls'):
+    """(tweet_id, url, kind, position) table, one row per url; position starts at 0."""
+    urls = df[[id_col, url_col]].dropna(subset=[url_col])
+    # number the urls per source row, df's index may repeat (e.g. concatenated archives)
+    urls = urls.assign(url=urls[url_col].str.split(','), row=np.arange(len(urls))).explode('url')
+    urls['url'] = normalize(urls['url'].astype(str))
+    urls = urls.dropna(subset=['url'])
+    urls['position'] = urls.groupby('row').cumcount()
+    urls['kind'] = classify(urls['url'])
+    return urls[[id_col, 'url', 'kind', 'position']].reset_index(drop=True)
+
+
+def url_counts(urls, id_col='tweet_id'):
+    """Per tweet: n_urls, n_<kind>s (n_photos, n_vines, ...) & has_<kind> flags."""
+    kinds = [kind for kind, _ in KINDS] + [OTHER]
+    tweets, tweet_ids = pd.factorize(urls[id_col])
+    kind_codes = pd.Categorical(urls['kind'], categories=kinds).codes
+    # one bincount over (tweet, kind) pairs instead of a pivot
+    flat = np.bincount(tweets * len(kinds) + kind_codes, minlength=len(tweet_ids) * len(kinds))
+    matrix = flat.reshape(len(tweet_ids), len(kinds))
+
+    counts = pd.DataFrame(matrix, index=pd.Index(tweet_ids, name=id_col),
+                          columns=['n_' + kind + 's' for kind in kinds])
+    counts.insert(0, 'n_urls', matrix.sum(axis=1))
+    for i, kind in enumerate(kinds):
+        counts['has_' + kind] = matrix[:, i] > 0
+    return counts
+
+
+def benchmark(df, n_rows=2000000):
+    """Seconds for explode_urls + url_counts on df's urls repeated to n_rows tweets."""
+    reps = int(np.ceil(n_rows / len(df)))
+    big = pd.DataFrame({'tweet_id': np.arange(len(df) * reps)[:n_rows],
+                        'expanded_urls': np.tile(df['expanded_urls'].values, reps)[:n_rows]})
+    start = timer()
+    urls = explode_urls(big)
+    exploded = timer() - start
+    url_counts(urls)
+    return {'rows': n_rows, 'urls': len(urls), 'explode_s': exploded, 'total_s': timer() - start}
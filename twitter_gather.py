@@ -0,0 +1,305 @@
+"""
+Gather #3 (Twitter API) as a function, with a record / replay layer.
+
+fetch_tweets() is the get_status loop of wrangle_act.py, plus retries on
+rate limits. It takes any object with a get_status(tweet_id, **kwargs)
+method, so it can run against:
+
+  * RecordingAPI - wraps the real tweepy.API & saves every response (or
+    error) into a gzip compressed fixture store
+  * ReplayAPI    - serves the fixture store offline, with configurable
+    latency, rate limits (incl. x-rate-limit-* headers) and injected
+    404 (deleted tweet) / 429 (rate limit) errors
+
+which lets the fetcher be tested & benchmarked in CI or air-gapped.
+
+    store = FixtureStore('data/fixtures/tweets.jsonl.gz')
+    fetch_tweets(RecordingAPI(api, store), tweet_ids, 'tweet_json.txt'); store.save()
+    fetch_tweets(ReplayAPI(store, latency=0.05, rate_limit=(900, 900)), tweet_ids, 'tweet_json.txt')
+
+With real time a replay of the archive waits on every 15 minute rate-limit
+window; a SimulatedClock passed as clock & sleep only adds up the waits:
+
+    clock = SimulatedClock()
+    api = ReplayAPI(store, latency=0.05, rate_limit=(900, 900), wait_on_rate_limit=True,
+                    clock=clock.time, sleep=clock.sleep)
+    fetch_tweets(api, tweet_ids, 'tweet_json.txt', sleep=clock.sleep)
+    clock.now                        # seconds the run would have taken against the API
+"""
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from timeit import default_timer as timer
+
+import numpy as np
+
+try:
+    import tweepy
+    TweepError = getattr(tweepy, 'TweepError', None) or tweepy.errors.TweepyException
+except ImportError:  # pragma: no cover - replay works without tweepy
+    tweepy = None
+    TweepError = Exception
+
+FIXTURES_PATH = 'data/fixtures/tweets.jsonl.gz'
+API_DATE_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+class FakeResponse(object):
+    """The parts of a requests.Response the fetcher looks at."""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class ReplayError(TweepError):
+    """Error raised by ReplayAPI, a tweepy error so existing except clauses catch it."""
+
+    def __init__(self, status, message, headers=None):
+        Exception.__init__(self, message)
+        self.reason = message
+        self.status = status
+        self.api_code = {404: 144, 429: 88}.get(status)
+        self.response = FakeResponse(status, headers)
+
+
+def error_status(error):
+    """HTTP status of a tweepy (3.x or 4.x) or replay error, None if unknown."""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    return status or getattr(error, 'status', None)
+
+
+class Status(object):
+    """Stand-in for tweepy.Status, only ._json is used by the gather."""
+
+    def __init__(self, data):
+        self._json = data
+
+
+class FixtureStore(object):
+    """tweet_id -> recorded response, kept as gzip compressed JSON lines."""
+
+    def __init__(self, path=FIXTURES_PATH):
+        self.path = path
+        self.records = {}
+        if path and os.path.exists(path):
+            with gzip.open(path, 'rt') as infile:
+                for line in infile:
+                    record = json.loads(line)
+                    self.records[record['id']] = record
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.records
+
+    def get(self, tweet_id):
+        return self.records.get(tweet_id)
+
+    def add(self, tweet_id, status, data=None, error=None, headers=None):
+        self.records[tweet_id] = {'id': tweet_id, 'status': status, 'json': data,
+                                  'error': error, 'headers': headers or {}}
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with gzip.open(tmp, 'wt') as outfile:
+            for record in self.records.values():
+                outfile.write(json.dumps(record) + '\n')
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_archive(cls, archive, path=None, seed=0):
+        """
+        Synthetic store with a minimal API tweet per archive row, for benchmarks
+        at scale without ever having recorded (retweet & favorite counts are random).
+        """
+        import pandas as pd
+
+        store = cls(path=None)
+        store.path = path
+        rng = np.random.default_rng(seed)
+        created = pd.to_datetime(archive['timestamp'], utc=True).dt.strftime(API_DATE_FORMAT)
+        favorites = rng.integers(0, 100000, len(archive))
+        retweets = rng.integers(0, 30000, len(archive))
+        for i, (tweet_id, text) in enumerate(zip(archive['tweet_id'].values, archive['text'].values)):
+            tweet_id = int(tweet_id)
+            store.add(tweet_id, 200, {
+                'created_at': created.iloc[i], 'id': tweet_id, 'id_str': str(tweet_id),
+                'full_text': text, 'display_text_range': [0, len(text)],
+                'retweet_count': int(retweets[i]), 'favorite_count': int(favorites[i]),
+                'user': {'id': 4196983835, 'screen_name': 'dog_rates'},
+            })
+        return store
+
+
+class RecordingAPI(object):
+    """Wraps a tweepy.API, every get_status response or error goes into store."""
+
+    def __init__(self, api, store):
+        self.api = api
+        self.store = store
+
+    def _headers(self):
+        response = getattr(self.api, 'last_response', None)
+        return dict(getattr(response, 'headers', {}) or {})
+
+    def get_status(self, tweet_id, **kwargs):
+        try:
+            tweet = self.api.get_status(tweet_id, **kwargs)
+        except TweepError as e:
+            status = error_status(e)
+            # rate limits say nothing about the tweet, don't record them
+            if status != 429:
+                self.store.add(int(tweet_id), status, error=str(e), headers=self._headers())
+            raise
+        self.store.add(int(tweet_id), 200, data=tweet._json, headers=self._headers())
+        return tweet
+
+
+class SimulatedClock(object):
+    """A clock whose sleep() advances it instantly, for ReplayAPI & fetch_tweets."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(seconds, 0.0)
+
+
+class ReplayAPI(object):
+    """
+    Serves a FixtureStore like tweepy.API.get_status.
+
+    latency    - seconds per call, or (low, high) for a uniform random latency
+    rate_limit - (calls, window seconds); over the limit a 429 is raised, or the call
+                 waits for the window to reset if wait_on_rate_limit
+    error_404  - chance of answering 404 (deleted tweet) for a recorded tweet
+    error_429  - chance of answering 429 regardless of the rate limit
+    Tweets missing from the store are answered with 404.
+    """
+
+    def __init__(self, store, latency=0.0, rate_limit=None, error_404=0.0, error_429=0.0,
+                 wait_on_rate_limit=False, seed=0, clock=time.monotonic, sleep=time.sleep):
+        self.store = store
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_404 = error_404
+        self.error_429 = error_429
+        self.wait_on_rate_limit = wait_on_rate_limit
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.window_start = clock()
+        self.calls_in_window = 0
+        self.calls = 0
+        self.last_response = None
+
+    def _limit_headers(self):
+        if not self.rate_limit:
+            return {}
+        limit, window = self.rate_limit
+        return {'x-rate-limit-limit': str(limit),
+                'x-rate-limit-remaining': str(max(limit - self.calls_in_window, 0)),
+                'x-rate-limit-reset': str(int(time.time() + window - (self.clock() - self.window_start)))}
+
+    def _take_call(self):
+        """Count a call against the rate limit, returns seconds to wait (0 if allowed)."""
+        if not self.rate_limit:
+            return 0.0
+        limit, window = self.rate_limit
+        with self.lock:
+            now = self.clock()
+            if now - self.window_start >= window:
+                self.window_start, self.calls_in_window = now, 0
+            if self.calls_in_window >= limit:
+                return window - (now - self.window_start)
+            self.calls_in_window += 1
+            return 0.0
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            self.sleep(latency)
+
+    def get_status(self, tweet_id, **kwargs):
+        self.calls += 1
+        wait = self._take_call()
+        while wait > 0 and self.wait_on_rate_limit:
+            self.sleep(wait)
+            wait = self._take_call()
+        self._delay()
+
+        headers = self._limit_headers()
+        self.last_response = FakeResponse(200, headers)
+        if wait > 0 or self.random.random() < self.error_429:
+            self.last_response = FakeResponse(429, headers)
+            raise ReplayError(429, 'Rate limit exceeded', headers)
+
+        record = self.store.get(int(tweet_id))
+        if record is None or record['status'] == 404 or self.random.random() < self.error_404:
+            self.last_response = FakeResponse(404, headers)
+            raise ReplayError(404, 'No status found with that ID.', headers)
+        if record['status'] != 200:
+            self.last_response = FakeResponse(record['status'], headers)
+            raise ReplayError(record['status'], record.get('error') or 'error', headers)
+        return Status(record['json'])
+
+
+def _reset_wait(error, default):
+    """Seconds until the rate limit resets according to the error's headers."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    reset = headers.get('x-rate-limit-reset')
+    if reset is None:
+        return default
+    return max(float(reset) - time.time(), 0.0) or default
+
+
+def fetch_tweets(api, tweet_ids, out_path, max_retries=3, backoff=1.0, sleep=time.sleep, verbose=False):
+    """
+    Save each tweet's JSON as a line of out_path, like the gather loop in wrangle_act.py.
+
+    429s wait for the rate-limit reset (or backoff * 2**attempt) and retry, other
+    errors except 404 are retried up to max_retries times; 404s are not retried.
+    Returns stats: fetched, failed {tweet_id: error}, retries, seconds, tweets_per_sec.
+    """
+    fails_dict = {}
+    fetched = retries = 0
+    start = timer()
+    with open(out_path, 'w') as outfile:
+        for count, tweet_id in enumerate(tweet_ids, 1):
+            if verbose:
+                print(str(count) + ": " + str(tweet_id))
+            for attempt in range(max_retries + 1):
+                try:
+                    tweet = api.get_status(tweet_id, tweet_mode='extended')
+                except TweepError as e:
+                    status = error_status(e)
+                    if status == 404 or attempt == max_retries:
+                        fails_dict[tweet_id] = e
+                        break
+                    retries += 1
+                    wait = backoff * 2 ** attempt
+                    sleep(_reset_wait(e, wait) if status == 429 else wait)
+                    continue
+                json.dump(tweet._json, outfile)
+                outfile.write('\n')
+                fetched += 1
+                break
+    elapsed = timer() - start
+    return {'fetched': fetched, 'failed': fails_dict, 'retries': retries, 'seconds': elapsed,
+            'tweets_per_sec': fetched / elapsed if elapsed else 0.0}
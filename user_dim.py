@@ -0,0 +1,134 @@
+"""
+Normalize the tweet 'user' object into a user dimension table.
+
+Every API tweet carries the full user dict of its account, the same account
+thousands of times with mostly only the counts changing. UserDimension keeps
+one row per account & snapshot time (when the user dict was fetched), keyed
+by an integer user_key; the tweets keep only user_key. The follower counts of
+an account over time are then its rows ordered by snapshot_time.
+
+    users = UserDimension.load()                         # empty if no file yet
+    rt_tweets = users.split(rt_tweets, snapshot_time=fetch_time(glob('tweet*.json')))
+    users.save()
+    rt_tweets.merge(users.frame(), on='user_key')        # when user columns are needed
+"""
+import json
+import os
+
+import pandas as pd
+
+from timestamps import to_utc
+
+# scalar user fields copied into the dimension table
+USER_COLS = ['id', 'screen_name', 'name', 'followers_count', 'friends_count', 'listed_count',
+             'favourites_count', 'statuses_count', 'verified', 'created_at']
+USERS_PATH = 'twitter_archive_users.csv'
+# frame() names of the user fields
+RENAME = {'id': 'user_id', 'name': 'user_name', 'created_at': 'user_created_at'}
+
+
+def fetch_time(paths):
+    """
+    When the newest of paths (a path or list of the fetched shards) was written,
+    its mtime as a UTC Timestamp: the snapshot time of the user dicts in them.
+    Files derived from the shards (dedup_shards' output) keep the shards' mtime.
+    """
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    return pd.Timestamp(max(os.path.getmtime(path) for path in paths), unit='s', tz='UTC').floor('s')
+
+
+def as_snapshot(value):
+    """value (a timestamp or string) as a UTC Timestamp."""
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+class UserDimension(object):
+    """Distinct user snapshots, keys stay stable across runs when saved & loaded."""
+
+    def __init__(self):
+        self.keys = {}
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def key(self, user, snapshot_time):
+        """
+        user_key of a user dict at snapshot_time (a UTC Timestamp), adding a
+        row the first time this account is seen at this time.
+        """
+        if not isinstance(user, dict):
+            return None
+        ident = (user.get('id'), snapshot_time)
+        key = self.keys.get(ident)
+        if key is None:
+            key = len(self.rows)
+            self.keys[ident] = key
+            row = {col: user.get(col) for col in USER_COLS}
+            row['user_key'] = key
+            row['snapshot_time'] = snapshot_time
+            self.rows.append(row)
+        return key
+
+    def split(self, tweets, user_col='user', snapshot_time=None):
+        """
+        tweets with user_col replaced by an integer user_key column.
+        snapshot_time - when the tweets were fetched (see fetch_time), by default
+        each tweet's created_at
+        """
+        if snapshot_time is None:
+            times = to_utc(tweets['created_at']).tolist()
+        else:
+            times = [as_snapshot(snapshot_time)] * len(tweets)
+        keys = [self.key(user, time) for user, time in zip(tweets[user_col].values, times)]
+        out = tweets.drop(columns=[user_col])
+        out['user_key'] = pd.array(keys, dtype='Int64')
+        return out
+
+    def read_jsonl(self, path, snapshot_time=None):
+        """
+        Read a tweet JSONL file without ever building the user column: each
+        line's user dict is replaced by its key while parsing. The snapshot
+        time defaults to the file's fetch_time.
+        """
+        snapshot_time = as_snapshot(snapshot_time if snapshot_time is not None else fetch_time(path))
+        records = []
+        with open(path) as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                tweet = json.loads(line)
+                tweet['user_key'] = self.key(tweet.pop('user', None), snapshot_time)
+                records.append(tweet)
+        tweets = pd.DataFrame.from_records(records)
+        if 'user_key' in tweets.columns:
+            tweets['user_key'] = tweets['user_key'].astype('Int64')
+        return tweets
+
+    def frame(self):
+        """The dimension table, one row per user snapshot."""
+        users = pd.DataFrame(self.rows, columns=['user_key'] + USER_COLS + ['snapshot_time'])
+        users['snapshot_time'] = pd.to_datetime(users['snapshot_time'], utc=True)
+        return users.rename(columns=RENAME)
+
+    def save(self, path=USERS_PATH):
+        tmp = path + '.tmp'
+        self.frame().to_csv(tmp, index=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=USERS_PATH):
+        """Saved user dimension, or an empty one if path doesn't exist yet."""
+        users = cls()
+        if not os.path.exists(path):
+            return users
+        frame = pd.read_csv(path)
+        frame['snapshot_time'] = pd.to_datetime(frame['snapshot_time'], utc=True)
+        frame = frame.rename(columns={new: old for old, new in RENAME.items()}).sort_values('user_key')
+        for row in frame.to_dict('records'):
+            row = {col: (None if pd.isna(value) else value) if col != 'snapshot_time' else value
+                   for col, value in row.items()}
+            users.keys[(row['id'], row['snapshot_time'])] = row['user_key']
+            users.rows.append(row)
+        return users
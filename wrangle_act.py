@@ -88,6 +88,31 @@ from timeit import default_timer as timer
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.patches import ConnectionPatch
+
+from timestamps import parse_timestamps
+from quality_checks import run_checks, ARCHIVE_CHECKS, MASTER_CHECKS
+from dedup import dedup_shards
+from glob import glob
+from text_index import TweetIndex
+from dog_stages import add_stages, stage_labels
+from image_cache import fetch_images, cache_paths, make_thumbnails
+from breed_rank import top_breeds
+from breed_stats import mean_ci, score_ci, xerr
+from rollups import update_rollups, rolling
+from shared_master import publish_master
+from encoding import encode_categories
+from partitioned_master import write_partitioned, read_partitioned
+from pipeline import wrangle_pipeline
+from twitter_gather import FixtureStore, ReplayAPI, SimulatedClock, fetch_tweets, FIXTURES_PATH
+from tweet_reader import read_tweets
+from tweet_urls import explode_urls, url_counts
+from user_dim import UserDimension, fetch_time
+from entities import read_tweet_tables
+from threads import ThreadIndex
+from sketches import TweetSketches
+from streaming import StreamProcessor, replay
+from near_dups import near_duplicates, drop_near_duplicates
+from query import Query
 # %matplotlib inline
 
 
@@ -101,6 +126,16 @@ replytweetsDF = mainDF[mainDF.in_reply_to_status_id.notnull()]
 # %%
 replytweetsDF.sample(5)
 
+# %%
+# link the replies to their parent tweets: thread, root tweet & depth per tweet
+threads = ThreadIndex.from_frame(mainDF)
+threadsDF = threads.frame(mainDF.tweet_id)
+threadsDF[threadsDF.depth > 0].head()
+
+# %%
+# the longest thread, root first
+threads.thread(threads.thread_sizes().index[0])
+
 # %%
 mainDF[mainDF.tweet_id.duplicated()]
 
@@ -140,6 +175,12 @@ twitterDF[twitterDF['floofer'] != 'None'].head(3)
 # it appears the designations were pulled from the tweeted text, 'doggo' & 'floofer' in text below
 twitterDF.loc[200,'text']
 
+# %%
+# index the tweet text once, then look up tweets by word, #hashtag, @mention or rating instead of .str.contains scans
+text_index = TweetIndex()
+text_index.add_frame(twitterDF, 'text')
+twitterDF[twitterDF.tweet_id.isin(text_index.search('doggo', 'floofer'))]
+
 # %%
 # Illustrating that pup designations are NOT singular. Multiple 
 twitterDF[twitterDF['doggo'] != 'None'].sample(5)
@@ -150,9 +191,9 @@ twitterDF[twitterDF['doggo'] != 'None'].sample(5)
 # Q1 = Quality Item #1
 
 # %%
-# Fixed 2 columns with incorrect datatypes, changed to datetime64
-twitterDF.timestamp = pd.to_datetime(twitterDF.timestamp)
-twitterDF.retweeted_status_timestamp = pd.to_datetime(twitterDF.retweeted_status_timestamp)
+# Fixed timestamp column with incorrect datatype, changed to datetime64 (UTC) using an explicit format
+# retweeted_status_timestamp is skipped, Q5 drops it with the retweets
+twitterDF = parse_timestamps(twitterDF)
 twitterDF.info()
 
 # %% [markdown]
@@ -170,28 +211,10 @@ twitterDF[twitterDF.name == 'a']
 # ## <a name="q3"> Q3 - doggo, floofer, pupper, & puppo use None; Replace with NaN, or 0, & 1 for present </a>
 
 # %%
-# replace 'None' with 0
-# replace 'doggo' with 1
-twitterDF.doggo = np.where(twitterDF.doggo == 'None', 0, twitterDF.doggo)
-twitterDF.doggo = np.where(twitterDF.doggo == 'doggo', 1, twitterDF.doggo)
-
-# %%
-# replace 'None' with 0
-# replace 'floofer' with 1
-twitterDF.floofer = np.where(twitterDF.floofer == 'None', 0, twitterDF.floofer)
-twitterDF.floofer = np.where(twitterDF.floofer == 'floofer', 1, twitterDF.floofer)
-
-# %%
-# replace 'None' with 0
-# replace 'pupper' with 1
-twitterDF.pupper = np.where(twitterDF.pupper == 'None', 0, twitterDF.pupper)
-twitterDF.pupper = np.where(twitterDF.pupper == 'pupper', 1, twitterDF.pupper)
-
-# %%
-# replace 'None' with 0
-# replace 'puppo' with 1
-twitterDF.puppo = np.where(twitterDF.puppo == 'None', 0, twitterDF.puppo)
-twitterDF.puppo = np.where(twitterDF.puppo == 'puppo', 1, twitterDF.puppo)
+# re-derive doggo, floofer, pupper & puppo from the text in one regex pass (also catches 'doggos', "pupper's", ...)
+# stage_mask holds all stages of a tweet as bits, the 4 columns become 0 / 1
+twitterDF = add_stages(twitterDF)
+stage_labels(twitterDF.stage_mask).value_counts()
 
 # %%
 # check to ensure cleaning successful
@@ -260,6 +283,10 @@ twitterDF.info()
 # check to ensure cols dropped
 twitterDF.info()
 
+# %%
+# run all archive quality checks in one pass, failed > 0 shows what is left to clean
+run_checks(twitterDF, ARCHIVE_CHECKS)
+
 # %% [markdown]
 # ## <a name="q6">Q6 - `in_reply_to_status_id` and `in_reply_to_user_id` are type float. Convert to string</a>
 
@@ -295,6 +322,24 @@ image_preds.sample(5)
 # data exploration
 image_preds.info()
 
+# %%
+# download the images themselves into data/images (content-addressed, each url fetched once)
+image_fetch = fetch_images(image_preds.jpg_url)
+image_fetch['images_per_sec'], len(image_fetch['failed'])
+
+# %%
+img_paths = cache_paths(image_preds.jpg_url)
+thumbs = make_thumbnails(img_paths)
+
+# %%
+# re-score the cached images with a local model (needs torch & torchvision), same columns as image_preds
+# only images not already in data/image-predictions-rescored.tsv get scored, so this can be stopped & re-run
+'''
+from rescore import rescore, TorchvisionModel
+image_preds_rescored, rescore_stats = rescore(image_preds, img_paths, TorchvisionModel('resnet50', threads=4), batch_size=32)
+rescore_stats['images_per_sec']
+'''
+
 # %% [markdown]
 # [BACK TO TOP](#top)
 
@@ -352,18 +397,49 @@ print(end - start)
 print(fails_dict)
 '''
 
+# %%
+# same loop via twitter_gather.fetch_tweets, recording every response into data/fixtures/tweets.jsonl.gz
+'''
+from twitter_gather import FixtureStore, RecordingAPI, fetch_tweets
+store = FixtureStore()
+fetch_stats = fetch_tweets(RecordingAPI(api, store), tweet_ids, 'tweet_json.txt', verbose=True)
+store.save()
+'''
+
+# %%
+# offline (CI, no keys): replay the recorded responses with API-like latency & rate limits
+# on a simulated clock, the latency & rate-limit waits are added up instead of slept
+# (pass clock=time.monotonic, sleep=time.sleep for a wall-clock benchmark)
+if os.path.exists(FIXTURES_PATH):
+    replay_clock = SimulatedClock()
+    replay_api = ReplayAPI(FixtureStore(), latency=(0.05, 0.2), rate_limit=(900, 900), wait_on_rate_limit=True,
+                           clock=replay_clock.time, sleep=replay_clock.sleep)
+    fetch_stats = fetch_tweets(replay_api, tweet_ids, 'tweet_json_replay.txt', sleep=replay_clock.sleep)
+    print(fetch_stats['tweets_per_sec'], len(fetch_stats['failed']), replay_clock.now)
+
 # %% [markdown]
 # ### Start from here if data already obtained from Twitter                                                   
 #
 # [BACK TO TOP](#top)
 
+# %%
+# re-running the gather (or a failed partial run) leaves duplicate tweet lines across tweet*.json files
+# keep only the latest fetch of each tweet so the merges on tweet_id don't multiply rows
+dedup_shards(glob("tweet*.json"), "tweet_latest.jsonl")
+
 # %%
 # Read tweet JSON into dataframe using pandas
 # recived ValueError: Trailing data without 'lines=True'
 
-rt_tweets = pd.read_json("tweet.json", lines=True)
+rt_tweets = pd.read_json("tweet_latest.jsonl", lines=True)
 rt_tweets.head(5)
 
+# %%
+# archived fetches are kept as compressed shards (data/tweets/*.jsonl.gz / .zst), read them in parallel instead
+if glob("data/tweets/*.jsonl*"):
+    rt_tweets, read_stats = read_tweets("data/tweets/*.jsonl*")
+    print(read_stats['mb_per_sec_per_core'], read_stats['mb_per_sec'])
+
 # %%
 # data exploration
 rt_tweets.info()
@@ -392,6 +468,13 @@ rt_tweets.loc[0,'extended_entities']
 # inspect the entities data
 rt_tweets.loc[115,'entities']
 
+# %%
+# keep the media ids & types, hashtags and mentions as child tables on tweet_id
+# collected while the JSON lines are parsed, instead of apply-ing over the dict columns
+_, entity_tables = read_tweet_tables("tweet_latest.jsonl")
+media, hashtags, mentions = entity_tables['media'], entity_tables['hashtags'], entity_tables['mentions']
+media.type.value_counts()
+
 # %% jupyter={"outputs_hidden": true}
 # data exploration
 rt_tweets.loc[130,'user']
@@ -403,9 +486,19 @@ rt_tweets.iloc[1:8,11:]
 # %% [markdown]
 # ## <a name="t1">Tidy #1 - create new dataframe of columns needed</a>
 
+# %%
+# the same user dict is repeated on every tweet; keep one row per user & fetch time in a user table
+# (twitter_archive_users.csv, grows a row per account every new fetch) and only an integer user_key
+# on the tweets (join users on user_key when needed)
+user_dim = UserDimension.load()
+rt_tweets = user_dim.split(rt_tweets, snapshot_time=fetch_time(glob("tweet*.json")))
+user_dim.save()
+users = user_dim.frame()
+users
+
 # %%
 # add columns to this list for creating a new DF with only columns we want only
-tweet_cols = ['created_at','id','full_text','display_text_range','retweet_count','favorite_count','user']
+tweet_cols = ['created_at','id','full_text','display_text_range','retweet_count','favorite_count','user_key']
 
 # %%
 # create new DF with column defined above
@@ -438,6 +531,11 @@ image_preds.info()
 rt_tweets_sub = rt_tweets_sub.rename(columns={"id":"tweet_id"})
 rt_tweets_sub.head(5)
 
+# %%
+# created_at uses the API date string, normalize it to UTC like the archive timestamp
+rt_tweets_sub = parse_timestamps(rt_tweets_sub)
+rt_tweets_sub.created_at.head(3)
+
 # %%
 # MERGE 2 dataframes!
 new_tweets_df = pd.merge(rt_tweets_sub, twitterDF, on='tweet_id')
@@ -451,6 +549,10 @@ new_tweets_df.info()
 # MERGE newly merged dataframe and image_preds to get new_tweets_df2
 new_tweets_df2 = pd.merge(new_tweets_df, image_preds, on='tweet_id')
 
+# %%
+# quality checks on the merged data, pass row_budget=... to sample very large archives
+run_checks(new_tweets_df2, MASTER_CHECKS)
+
 # %% [markdown]
 # ## <a name="save1">New Dataframe saved to file</a>
 
@@ -458,6 +560,36 @@ new_tweets_df2 = pd.merge(new_tweets_df, image_preds, on='tweet_id')
 # write new dataframe to file
 new_tweets_df2.to_csv("twitter_archive_master.csv")
 
+# %%
+# also publish it as a memory-mappable Arrow file (master/master-<version>.arrow) & point master/CURRENT at it
+# worker processes open it with shared_master.MasterReader() instead of parsing the csv each
+publish_master(new_tweets_df2)
+
+# %%
+# and partitioned by year/month of timestamp (twitter_archive_master/year=YYYY/month=MM/part.parquet)
+# a question about one month then only opens that month's file
+write_partitioned(new_tweets_df2, fmt='parquet')
+read_partitioned(start='2017-07-01', end='2017-07-31 23:59:59').shape
+
+# %%
+# daily / weekly / monthly rollups saved next to the master file (twitter_archive_rollup_*.csv)
+# tweets not rolled up yet (by tweet_id, see twitter_archive_rollup_ids.npy) are added onto the stored buckets, re-runs add nothing
+rollups = update_rollups(new_tweets_df2)
+rollups['monthly']
+
+# %%
+# 7 day rolling window of the daily rollup
+rolling(rollups['daily_sums'], '7D').tail(10)
+
+# %%
+# approximate name & breed counts and favorite / retweet quantiles in constant memory
+# the saved sketches (twitter_archive_sketches.json) only take the tweets newer than the largest tweet_id they hold
+sketches = TweetSketches.load()
+sketches.update(new_tweets_df2)
+sketches.save()
+sketch_summary = sketches.summary()
+sketch_summary['distinct'], sketch_summary['top']['name'], sketch_summary['quantiles']
+
 # %% [markdown]
 # [BACK TO TOP](#top)
 
@@ -473,12 +605,30 @@ new_tweets_df2.name.isnull().count()
 # data exploration
 new_tweets_df2.loc[576,'expanded_urls']
 
+# %%
+# one row per url with its kind (photo, video, vine, gofundme, ...) & per tweet counts, e.g. n_photos, has_vine
+tweet_urls = explode_urls(new_tweets_df2)
+media_counts = url_counts(tweet_urls)
+media_counts.loc[new_tweets_df2.loc[576,'tweet_id']]
+
 # %%
 # data exploration
 new_tweets_df2.info()
 
 # %%
-count_by_name = new_tweets_df2.groupby('p1')['p1_conf'].size()
+# re-posts with (nearly) the same text aren't retweets, so Q5 keeps them; they would count twice below
+# cluster them by MinHash/LSH on the text and keep only the oldest tweet of each cluster for the analysis
+near_dup_clusters = near_duplicates(new_tweets_df2)
+new_tweets_df2 = drop_near_duplicates(new_tweets_df2, near_dup_clusters)
+near_dup_clusters
+
+# %%
+# low-cardinality text columns (source, name, p1..p3, ...) to category, codes stay the same across runs
+new_tweets_df2, encoding_report = encode_categories(new_tweets_df2)
+encoding_report
+
+# %%
+count_by_name = new_tweets_df2.groupby('p1', observed=True)['p1_conf'].size()
 
 # %%
 count_by_name.sort_values(ascending=False)
@@ -493,6 +643,12 @@ top10_names.index.values
 # %%
 top10_val_array = top10_names.values
 
+# %%
+# count_by_name counts every p1 guess, also non-dogs & unsure ones
+# rank on the best dog prediction among p1..p3 instead, weighted by confidence (>= 0.2)
+top10_dogs = top_breeds(new_tweets_df2, k=10, min_conf=0.2)
+top10_dogs
+
 
 # %% [markdown]
 # ## <a name="vis1"> Horizontal Bar Chart to visualize the top 10 breeds represented during the timeframe </a>
@@ -500,29 +656,24 @@ top10_val_array = top10_names.values
 # %%
 # Horizontal Bar Chart to visualize the top 10 breeds represented during the timeframe
 
-# Fixing random state for reproducibility
-np.random.seed(19680801)
-
+# 95% bootstrap confidence intervals of the breed scores, used as error bars
+top10_ci = score_ci(new_tweets_df2, min_conf=0.2).loc[top10_dogs.index]
 
 plt.rcdefaults()
 fig, ax = plt.subplots()
 
-# Example data
-#people = ('Tom', 'Dick', 'Harry', 'Slim', 'Jim')
-#performance = 3 + 10 * np.random.rand(len(people))
-
-people = top10_names.index.values 
+people = top10_dogs.index.values 
 
 y_pos = np.arange(len(people))
 
-performance = top10_names.values
-error = np.random.rand(len(people))
+performance = top10_dogs['score'].values
+error = xerr(top10_ci, 'score')
 
 ax.barh(y_pos, performance, xerr=error, align='center')
 ax.set_yticks(y_pos)
 ax.set_yticklabels(people)
 ax.invert_yaxis()  # labels read top-to-bottom
-ax.set_xlabel('Dog Type (predicted) Count ')
+ax.set_xlabel('Dog Type (predicted) Count, confidence weighted')
 ax.set_title('WeRateDogs Dog Breeds represented (top 10)')
 
 plt.show()
@@ -559,8 +710,9 @@ new_tweets_df2[desig].mean()
 ## Owner named their dog. There were a lot of missing values here
 ## Data Exploration 
 ## Names most used
+## (name is a category with every name ever seen, keep only the ones used here)
 
-new_tweets_df2.name.value_counts()
+new_tweets_df2.name.value_counts()[lambda counts: counts > 0]
 
 # %% [markdown]
 # [BACK TO TOP](#top)
@@ -582,7 +734,7 @@ newtop10
 # This one provides appropriate columns but it correctly displayed the resulting dataframe in p1 alphabetic order
 # which is not statistically significant
 
-name_by_avgs = new_tweets_df2.groupby("p1")[['p1_conf','rating_numerator','rating_denominator','doggo','floofer','pupper','puppo','favorite_count',
+name_by_avgs = new_tweets_df2.groupby("p1", observed=True)[['p1_conf','rating_numerator','rating_denominator','doggo','floofer','pupper','puppo','favorite_count',
                              'retweet_count']].mean()
 #Actually, you just need to pull out the rows you want, top10names, from the name_by_avgs. It's just sorted alphabetically
 #name_by_avgs = new_tweets_df2.groupby(new_tweets_df2[newtop10])[['p1_conf','rating_numerator','rating_denominator','doggo','floofer',
@@ -623,10 +775,30 @@ top15_favorites = favorites_by_name.iloc[0:15,:]
 group_names = top15_favorites.index
 group_data = top15_favorites.favorite_count
 
+# %%
+# the same 2 reports as lazy queries on the partitioned master: only the columns they use are read,
+# the .loc[newtop10] filter is applied while reading, and for the top 15 only favorite_count & p1 are
+# aggregated for every breed, the other means only for the 15 winners
+# the partitioned master was written before the near-duplicate drop, so the dropped re-posts are filtered out too
+avg_cols = ['p1_conf','rating_numerator','rating_denominator','doggo','floofer','pupper','puppo','favorite_count',
+            'retweet_count']
+near_dup_ids = near_dup_clusters.loc[~near_dup_clusters.keep, 'tweet_id'].tolist()
+master_q = Query.partitioned().filter(('tweet_id', 'not in', near_dup_ids))
+top10stats_q = master_q.group_by('p1').agg(**{col: 'mean' for col in avg_cols}).filter(('p1', 'in', newtop10))
+top15_favorites_q = master_q.group_by('p1').agg(**{col: 'mean' for col in avg_cols}).top(15, 'favorite_count')
+print(top15_favorites_q.explain())
+top10stats_q.collect().loc[newtop10], top15_favorites_q.collect()[['favorite_count']], top15_favorites_q.stats
+
+# %%
+# 95% bootstrap confidence intervals of the mean favorites, rating & retweets per p1
+p1_ci = mean_ci(new_tweets_df2, 'p1', ['favorite_count', 'retweet_count', 'rating'])
+top15_ci = p1_ci.loc[group_names]
+top15_ci
+
 # %%
 plt.style.use('fivethirtyeight')
 fig, ax = plt.subplots(figsize=(6, 4))
-ax.barh(group_names, group_data)
+ax.barh(group_names, group_data, xerr=xerr(top15_ci, 'favorite_count'))
 labels = ax.get_xticklabels()
 plt.setp(labels, rotation=45, horizontalalignment='right')
 ax.set(xlim=[-10000, 70000], xlabel='No. of favorited tweets', ylabel='Names (guessed by learning model)',
@@ -641,3 +813,37 @@ plt.show;
 name_by_avgs
 
 # %%
+
+# %% [markdown]
+# ## <a name="pipeline">Run gather -> clean -> merge -> save as a pipeline</a>
+# The 3 gathers (and the per-source cleans) don't depend on each other, the pipeline runner runs them in parallel.
+
+# %%
+pipe = wrangle_pipeline(download=False)
+pipe.run(dry_run=True)
+
+# %%
+artifacts = pipe.run()
+pipe.report(), pipe.critical_path()
+
+# %%
+# same run with Arrow-backed columns & copy-on-write: column selection / renames share buffers instead of copying
+# stage_stats shows per stage how many columns were copied & the peak memory (stages run one at a time for it)
+stage_stats = {}
+arrow_artifacts = wrangle_pipeline(download=False, arrow=True, stats=stage_stats).run()
+pd.DataFrame(stage_stats).T
+
+# %% [markdown]
+# ## <a name="streaming">Streaming mode</a>
+# New tweets as events: cleaned per micro-batch with the same Q steps, joined with the cached image predictions
+# and added onto hourly / sliding window aggregates. The archive replayed in time order stands in for the Twitter stream.
+
+# %%
+stream = StreamProcessor(image_preds, pane='1D', max_window='7D', lateness='2D')
+stream.run(replay(mainDF.sort_values('timestamp'), rate=2000))
+
+# %%
+stream.tumbling().tail(10)
+
+# %%
+stream.sliding('7D').tail(5), stream.top_breeds('7D'), stream.latency()